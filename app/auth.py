@@ -1,50 +1,152 @@
+import base64
+import bcrypt
 import hashlib
-import datetime
-import random
-import string
-from datetime import timedelta
+import hmac
+import secrets
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Optional
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.cache import TTLCache
+from app.database import pool
+from app.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS,
+    TOKEN_CACHE_TTL_SECONDS,
+    TOKEN_CACHE_SIZE,
+    ROLE_CACHE_TTL_SECONDS,
+    ROLE_CACHE_SIZE
+)
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Decoded payloads of recently verified tokens, keyed by the raw token string
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Roles by user ID, filled at login and by lookups for tokens without a role claim
+_role_cache = TTLCache(maxsize=ROLE_CACHE_SIZE, ttl=ROLE_CACHE_TTL_SECONDS)
+
+_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
 
 def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password using bcrypt"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def _is_bcrypt_hash(hashed: str) -> bool:
+    return hashed.startswith("$2")
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return hash_password(password) == hashed
+    """Verify password against hash (bcrypt, or legacy unsalted SHA256)"""
+    if _is_bcrypt_hash(hashed):
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+    # Accounts registered before the bcrypt switch still store SHA256 hex digests
+    if len(hashed) != 64:
+        return False  # Corrupt row, not worth hashing against
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    """Check whether a stored hash should be upgraded to bcrypt"""
+    return not _is_bcrypt_hash(hashed)
 
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
-    expire = datetime.datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # JWT exp is POSIX seconds, so skip the datetime round trip
+    to_encode["exp"] = int(time.time()) + _EXPIRE_SECONDS
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current user from JWT token"""
+def _decode_token(token: str) -> dict:
+    """Decode and verify a JWT, reusing the result for repeated tokens"""
+    payload = _token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Never keep an entry past the token's own expiry
+        remaining = payload["exp"] - time.time() if "exp" in payload else TOKEN_CACHE_TTL_SECONDS
+        _token_cache.set(token, payload, ttl=min(TOKEN_CACHE_TTL_SECONDS, remaining))
+    return payload
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Identity and role carried by a verified access token"""
+    user_id: int
+    role: Optional[int] = None  # None for tokens issued before the role claim existed
+
+def get_current_user_with_role(credentials: HTTPAuthorizationCredentials = Depends(security)) -> CurrentUser:
+    """Get current user and role from JWT token"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(credentials.credentials)
         user_id: int = payload.get("user_id")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
+        return CurrentUser(user_id=user_id, role=payload.get("role"))
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def get_user_role(cursor, current_user: CurrentUser) -> int:
+    """Get the user's role from the token claim, querying Users only for tokens without one"""
+    if current_user.role is not None:
+        return current_user.role
+    role = _role_cache.get(current_user.user_id)
+    if role is None:
+        role = cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user.user_id).fetchval()
+        _role_cache.set(current_user.user_id, role)
+    return role
+
+def resolve_user_role(current_user: CurrentUser) -> Optional[int]:
+    """Get the user's role without holding a connection, borrowing one only for the rare database lookup"""
+    role = current_user.role if current_user.role is not None else _role_cache.get(current_user.user_id)
+    if role is None:
+        # Only tokens without a role claim, on a role cache miss, need the database
+        with pool.connection() as conn, closing(conn.cursor()) as cursor:
+            role = get_user_role(cursor, current_user)
+    return role
+
+def get_current_admin(current_user: CurrentUser = Depends(get_current_user_with_role)) -> CurrentUser:
+    """Get current user, rejecting anyone below admin (role 2 or 3) with 403"""
+    role = resolve_user_role(current_user)
+    if role is None or role < 2:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def remember_user_role(user_id: int, role: int):
+    """Write a user's role through to the role cache (call wherever a role is read or changed)"""
+    _role_cache.set(user_id, role)
+
+def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> Optional[CurrentUser]:
+    """Get current user from JWT token, or None for anonymous requests (never raises)"""
+    if credentials is None:
+        return None
+    try:
+        payload = _decode_token(credentials.credentials)
+    except jwt.JWTError:
+        return None
+    user_id = payload.get("user_id")
+    if user_id is None:
+        return None
+    return CurrentUser(user_id=user_id, role=payload.get("role"))
+
+def get_current_user(current_user: CurrentUser = Depends(get_current_user_with_role)) -> int:
+    """Get current user ID from JWT token"""
+    return current_user.user_id
+
+_PAYMENT_PREFIX = {
+    'Momo': 'MOMO',
+    'ZaloPay': 'ZALO',
+    'Credit Card': 'CARD',
+    'COD': 'COD'
+}
+
 def generate_transaction_code(payment_method: str) -> str:
     """Generate a simulated transaction code"""
-    prefix = {
-        'Momo': 'MOMO',
-        'ZaloPay': 'ZALO', 
-        'Credit Card': 'CARD',
-        'COD': 'COD'
-    }.get(payment_method, 'PAY')
+    prefix = _PAYMENT_PREFIX.get(payment_method, 'PAY')
     
-    random_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    # 5 random bytes encode to exactly 8 base32 characters (A-Z, 2-7)
+    random_code = base64.b32encode(secrets.token_bytes(5)).decode()
     return f"{prefix}{random_code}" 
\ No newline at end of file
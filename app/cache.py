@@ -0,0 +1,198 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+from app.streaming import json_bytes, json_loads
+from app.config import CHATBOT_CACHE_SIZE, INTENT_CACHE_TTL_SECONDS, PRODUCT_DETAIL_CACHE_SIZE, PRODUCT_DETAIL_CACHE_TTL_SECONDS, PRODUCT_LIST_CACHE_TTL_SECONDS, PRODUCT_NAME_CACHE_SIZE, PRODUCT_NAME_CACHE_TTL_SECONDS, REDIS_URL
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+_MISSING = object()
+
+# Optional shared second level behind the process-local caches
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True) if redis and REDIS_URL else None
+
+_product_names = TTLCache(PRODUCT_NAME_CACHE_SIZE, PRODUCT_NAME_CACHE_TTL_SECONDS)
+
+# Serialized GET /products bodies and their ETags, one per view; cleared by every product or stock change in this process
+product_list_cache = TTLCache(maxsize=2, ttl=PRODUCT_LIST_CACHE_TTL_SECONDS)
+
+# Single product rows by ProductID for the chatbot; dropped by product updates and cleared with product_list_cache on stock changes
+product_detail_cache = TTLCache(PRODUCT_DETAIL_CACHE_SIZE, PRODUCT_DETAIL_CACHE_TTL_SECONDS)
+
+# OpenAI results for normalized chat messages, keyed by kind and message hash
+_chatbot_results = TTLCache(CHATBOT_CACHE_SIZE, INTENT_CACHE_TTL_SECONDS)
+
+def _product_name_key(product_id: int) -> str:
+    return f"product:name:{product_id}"
+
+def get_product_names(cursor, product_ids: Iterable[int]) -> Dict[int, str]:
+    """Resolve product names from the local cache, then Redis, then the database"""
+    names = {}
+    missing = []
+    for product_id in set(product_ids):
+        name = _product_names.get(product_id, _MISSING)
+        if name is _MISSING:
+            missing.append(product_id)
+        else:
+            names[product_id] = name
+    
+    if missing and redis_client is not None:
+        try:
+            cached = redis_client.mget([_product_name_key(product_id) for product_id in missing])
+        except redis.RedisError:
+            cached = [None] * len(missing)
+        still_missing = []
+        for product_id, name in zip(missing, cached):
+            if name is None:
+                still_missing.append(product_id)
+            else:
+                names[product_id] = name
+                _product_names.set(product_id, name)
+        missing = still_missing
+    
+    if missing:
+        placeholders = ", ".join("?" * len(missing))
+        cursor.execute(f"SELECT ProductID, Name FROM Products WHERE ProductID IN ({placeholders})", *missing)
+        loaded = {product_id: name for product_id, name in cursor.fetchall()}
+        for product_id, name in loaded.items():
+            _product_names.set(product_id, name)
+        if loaded and redis_client is not None:
+            try:
+                pipe = redis_client.pipeline()
+                for product_id, name in loaded.items():
+                    pipe.set(_product_name_key(product_id), name, ex=PRODUCT_NAME_CACHE_TTL_SECONDS)
+                pipe.execute()
+            except redis.RedisError:
+                pass
+        names.update(loaded)
+    
+    return names
+
+def forget_product_name(product_id: int):
+    """Drop a product's cached name after it changes"""
+    _product_names.pop(product_id)
+    if redis_client is not None:
+        try:
+            redis_client.delete(_product_name_key(product_id))
+        except redis.RedisError:
+            pass
+
+def _chatbot_key(kind: str, text: str) -> str:
+    # Case, punctuation and spacing don't change what a message asks for
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+    return f"chatbot:{kind}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+def get_chatbot_result(kind: str, text: str) -> Optional[Any]:
+    """Return a cached chatbot result for the message from the local cache or Redis, or None"""
+    key = _chatbot_key(kind, text)
+    value = _chatbot_results.get(key)
+    if value is not None or redis_client is None:
+        return value
+    try:
+        cached = redis_client.get(key)
+    except redis.RedisError:
+        return None
+    if cached is None:
+        return None
+    value = json_loads(cached)
+    _chatbot_results.set(key, value)
+    return value
+
+def set_chatbot_result(kind: str, text: str, value: Any, ttl: float):
+    """Cache a chatbot result for the message locally and in Redis"""
+    key = _chatbot_key(kind, text)
+    _chatbot_results.set(key, value, ttl)
+    if redis_client is not None:
+        try:
+            redis_client.set(key, json_bytes(value), ex=int(ttl))
+        except redis.RedisError:
+            pass
+
+def _chat_context_keys(user_id: int) -> Tuple[str, str]:
+    return f"chat:context:{user_id}", f"chat:products:{user_id}"
+
+def load_chat_context(user_id: int) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """Return a user's chat state and last shown products from Redis, or None"""
+    try:
+        state, products = redis_client.mget(_chat_context_keys(user_id))
+    except redis.RedisError:
+        return None
+    if state is None:
+        return None
+    return json_loads(state), json_loads(products) if products else []
+
+def save_chat_context(user_id: int, state: Dict[str, Any], products: Optional[List[Dict[str, Any]]], ttl: float):
+    """Store a user's chat state in Redis; products=None keeps the stored list and only renews its expiry"""
+    state_key, products_key = _chat_context_keys(user_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(state_key, json_bytes(state), ex=int(ttl))
+        if products is None:
+            pipe.expire(products_key, int(ttl))
+        else:
+            pipe.set(products_key, json_bytes(products), ex=int(ttl))
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+def forget_chat_context(user_id: int):
+    """Drop a user's chat state from Redis"""
+    try:
+        redis_client.delete(*_chat_context_keys(user_id))
+    except redis.RedisError:
+        pass
@@ -4,6 +4,30 @@
 SECRET_KEY = "your-secret-key-change-this-in-production" #not need
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_TTL_SECONDS = 60  # How long a verified token skips signature checks
+TOKEN_CACHE_SIZE = 4096
+ROLE_CACHE_TTL_SECONDS = 60  # Role lookups for tokens issued without a role claim
+ROLE_CACHE_SIZE = 10000
+
+# Password hashing (bcrypt work factor, 2^rounds iterations)
+BCRYPT_ROUNDS = 12
+
+# Response caching
+CATEGORY_CACHE_TTL_SECONDS = 60
+PRODUCT_LIST_CACHE_TTL_SECONDS = 30  # Bounds staleness from writes in other workers
+PRODUCT_NAME_CACHE_SIZE = 100000  # Product names are near-immutable and read by every order view
+PRODUCT_NAME_CACHE_TTL_SECONDS = 300
+PRODUCT_DETAIL_CACHE_SIZE = 1024  # Products looked up by the chatbot's product view
+PRODUCT_DETAIL_CACHE_TTL_SECONDS = 30  # Includes stock, so kept as short as the product list
+CHATBOT_CACHE_SIZE = 10000  # Intent and attribute results for repeated chat messages
+INTENT_CACHE_TTL_SECONDS = 3600
+ATTRIBUTE_CACHE_TTL_SECONDS = 86400
+CHAT_CONTEXT_CACHE_SIZE = 10000  # Chat sessions held per worker when Redis is not configured
+CHAT_CONTEXT_TTL_SECONDS = 1800  # Idle chat sessions are forgotten after this long
+CHAT_CONTEXT_MAX_MESSAGES = 20  # Only the last few messages are sent to OpenAI
+CHAT_PROMPT_MESSAGE_MAX_CHARS = 200  # History messages are clipped to this length in prompts
+HEALTH_SNAPSHOT_INTERVAL_SECONDS = 30  # How often /health/database's table list and row counts are reloaded
+REDIS_URL = None  # e.g. "redis://localhost:6379/0" to share the product name cache, chatbot caches and chat sessions across workers (needs the redis package)
 
 # Database Configuration
 DATABASE_CONFIG = {
@@ -14,6 +38,24 @@ DATABASE_CONFIG = {
     "trust_server_certificate": "yes"
 }
 
+# Connection pool settings
+DB_POOL_SIZE = 20  # Idle connections kept open
+DB_POOL_MAX_OVERFLOW = 40  # Extra connections allowed under burst load
+DB_POOL_TIMEOUT_SECONDS = 30  # Wait for a free connection before failing
+DB_POOL_RECYCLE_SECONDS = 1800  # Reopen connections older than this
+DB_POOL_PING_AFTER_SECONDS = 30  # Validate connections idle longer than this
+
+# Threads available to sync route handlers; matches the most connections the pool can hand out
+THREADPOOL_SIZE = DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW
+ASYNC_EXECUTOR_SIZE = 32  # Threads behind asyncio.to_thread (chatbot cache, Redis and intent-model calls)
+CHATBOT_DB_WORKERS = DB_POOL_SIZE  # Threads running the chatbot's pyodbc work, leaving the overflow connections to sync handlers
+STREAM_BATCH_SIZE = 1000  # Rows fetched per round trip when streaming large result sets
+PRODUCT_PAGE_MAX_LIMIT = 200  # Largest page GET /products?limit= will return
+
+# File uploads
+UPLOAD_COPY_BUFFER_SIZE = 256 * 1024  # Bytes per read/write when saving uploaded images
+UPLOAD_SAVE_WORKERS = 4  # Images of one request written to disk in parallel
+
 # CORS Configuration
 CORS_ORIGINS = ["*"]  # In production, specify your frontend domains
 CORS_ALLOW_CREDENTIALS = True
@@ -25,9 +67,20 @@ API_TITLE = "Online Shop API"
 API_VERSION = "1.0.0"
 API_HOST = "0.0.0.0"
 API_PORT = 8000
+API_WORKERS = None  # None runs one worker process per CPU core when REDIS_URL is set, otherwise one, since chat sessions live in process memory
+SERVE_STATIC_FILES = True  # Set to False when a reverse proxy serves /static (see README)
 
 # OpenAI Configuration
 OPENAI_API_KEY = "your_openai_key_here"  # Replace with your actual API key
 OPENAI_MODEL = "gpt-4o-mini"
 OPENAI_MAX_TOKENS = 1000
-OPENAI_TEMPERATURE = 0.7 
+OPENAI_TEMPERATURE = 0.7
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 50
+OPENAI_MAX_CONCURRENT_CALLS = 50  # Completions in flight at once per worker; further calls wait their turn
+INTENT_BATCH_MAX_SIZE = 16  # Concurrent intent classifications sent as one prompt; 1 disables batching
+INTENT_BATCH_WINDOW_SECONDS = 0.02  # How long the first message waits for others to join its batch
+
+# Local intent model (needs onnxruntime); OpenAI classifies only the messages it is unsure about
+INTENT_MODEL_DIR = None  # e.g. "models/intent" holding model.onnx, tokenizer.json and labels.json
+INTENT_MODEL_MIN_CONFIDENCE = 0.6
@@ -1,15 +1,197 @@
+import queue
+import threading
+import time
+from contextlib import closing, contextmanager
+
 import pyodbc
-from app.config import DATABASE_CONFIG
+from app.config import (
+    DATABASE_CONFIG,
+    DB_POOL_SIZE,
+    DB_POOL_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_PING_AFTER_SECONDS
+)
+
+CONNECTION_STRING = (
+    f"DRIVER={{{DATABASE_CONFIG['driver']}}};"
+    f"SERVER={DATABASE_CONFIG['server']};"
+    f"DATABASE={DATABASE_CONFIG['database']};"
+    f"Trusted_Connection={DATABASE_CONFIG['trusted_connection']};"
+    f"TrustServerCertificate={DATABASE_CONFIG['trust_server_certificate']};"
+)
+
+# Session options some batches switch on and back off; restored on release only after a failure,
+# since an error, deadlock or timeout aborts a batch before its closing SET ... OFF lines
+RESET_SESSION_SQL = "SET NOCOUNT OFF; SET XACT_ABORT OFF;"
+
+def _decimal_to_float(value):
+    # pyodbc hands converters the raw text of the value, e.g. b"12.50"
+    return float(value) if value is not None else None
 
 def get_connection():
     """Get database connection"""
-    connection_string = (
-        f"DRIVER={{{DATABASE_CONFIG['driver']}}};"
-        f"SERVER={DATABASE_CONFIG['server']};"
-        f"DATABASE={DATABASE_CONFIG['database']};"
-        f"Trusted_Connection={DATABASE_CONFIG['trusted_connection']};"
-        f"TrustServerCertificate={DATABASE_CONFIG['trust_server_certificate']};"
-    )
-    
-    conn = pyodbc.connect(connection_string)
-    return conn 
\ No newline at end of file
+    conn = pyodbc.connect(CONNECTION_STRING)
+    # Return DECIMAL/NUMERIC columns as float instead of decimal.Decimal
+    for sql_type in (pyodbc.SQL_DECIMAL, pyodbc.SQL_NUMERIC):
+        conn.add_output_converter(sql_type, _decimal_to_float)
+    return conn
+
+def fetch_dicts(cursor) -> list:
+    """Fetch the remaining rows as dicts keyed by the result's column names"""
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+class PreparedStatement:
+    """A cursor dedicated to one SQL text, so pyodbc prepares it once per connection"""
+
+    def __init__(self, cursor, sql: str):
+        self._cursor = cursor
+        self._sql = sql
+
+    def fetchall(self, *params) -> list:
+        # Reading to the end releases the result set but keeps the statement prepared
+        return self._cursor.execute(self._sql, *params).fetchall()
+
+    def fetchone(self, *params):
+        rows = self.fetchall(*params)
+        return rows[0] if rows else None
+
+    def fetchval(self, *params):
+        row = self.fetchone(*params)
+        return row[0] if row is not None else None
+
+class ConnectionPool:
+    """Bounded pool of reusable pyodbc connections"""
+
+    def __init__(self, creator, pool_size: int, max_overflow: int, timeout: float, recycle: float, ping_after: float):
+        self._creator = creator
+        self._timeout = timeout
+        self._recycle = recycle
+        self._ping_after = ping_after
+        # Idle connections as (conn, created_at, returned_at); LIFO keeps hot connections hot
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size + max_overflow)
+        self._created_at = {}
+        # Prepared statements per pooled connection, keyed by id(conn) and then SQL text
+        self._statements = {}
+
+    def acquire(self):
+        """Check out a connection, opening a new one if none are idle"""
+        if not self._slots.acquire(timeout=self._timeout):
+            raise TimeoutError("Timed out waiting for a database connection")
+        try:
+            while True:
+                try:
+                    conn, created_at, returned_at = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._creator()
+                    self._created_at[id(conn)] = time.monotonic()
+                    return conn
+                now = time.monotonic()
+                if now - created_at > self._recycle:
+                    self._discard(conn)
+                    continue
+                if now - returned_at > self._ping_after and not self._ping(conn):
+                    self._discard(conn)
+                    continue
+                self._created_at[id(conn)] = created_at
+                return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, reset_session: bool = False):
+        """Return a connection to the pool, discarding it if it is unusable"""
+        try:
+            created_at = self._created_at.pop(id(conn), time.monotonic())
+            try:
+                # Never hand uncommitted work to the next borrower
+                conn.rollback()
+                if reset_session:
+                    # NOCOUNT left on by an aborted batch would make rowcount -1 for the next borrower
+                    conn.execute(RESET_SESSION_SQL).close()
+                self._idle.put_nowait((conn, created_at, time.monotonic()))
+            except (pyodbc.Error, queue.Full):
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def prepared(self, conn, sql: str) -> PreparedStatement:
+        """Return the connection's prepared statement for sql, preparing it on first use"""
+        statements = self._statements.setdefault(id(conn), {})
+        statement = statements.get(sql)
+        if statement is None:
+            statement = statements[sql] = PreparedStatement(conn.cursor(), sql)
+        return statement
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and returns it"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # Only a borrower that failed can have left a batch's session options switched on
+            self.release(conn, reset_session=True)
+            raise
+        else:
+            self.release(conn)
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        try:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute("SELECT 1").fetchval()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _discard(self, conn):
+        self._statements.pop(id(conn), None)
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+pool = ConnectionPool(
+    get_connection,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_MAX_OVERFLOW,
+    timeout=DB_POOL_TIMEOUT_SECONDS,
+    recycle=DB_POOL_RECYCLE_SECONDS,
+    ping_after=DB_POOL_PING_AFTER_SECONDS
+)
+
+def prepared(conn, sql: str) -> PreparedStatement:
+    """Prepared statement for sql on a pooled connection, reused across requests"""
+    return pool.prepared(conn, sql)
+
+def get_db():
+    """FastAPI dependency that yields a pooled connection for the request"""
+    with pool.connection() as conn:
+        yield conn
+
+def get_read_db():
+    """FastAPI dependency that yields a pooled connection in autocommit mode for read-only handlers"""
+    with pool.connection() as conn:
+        # Reads then never open a transaction, so the rollback on release costs no round trip
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            conn.autocommit = False
+
+def db_cursor():
+    """FastAPI dependency that yields a pooled cursor, committing on success and rolling back on error"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # Free the statement handle and any unread results before the connection goes back
+            cursor.close()
@@ -1,7 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from app.config import *
+from app.config import (
+    API_TITLE,
+    API_VERSION,
+    API_HOST,
+    API_PORT,
+    API_WORKERS,
+    SERVE_STATIC_FILES,
+    CORS_ORIGINS,
+    CORS_ALLOW_CREDENTIALS,
+    CORS_ALLOW_METHODS,
+    CORS_ALLOW_HEADERS,
+    THREADPOOL_SIZE,
+    ASYNC_EXECUTOR_SIZE
+)
 from app.routers import (
     health_router,
     auth_router,
@@ -14,17 +28,49 @@ from app.routers import (
     conversations_router,
     chatbot_router
 )
+from app.cache import redis_client
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+import anyio.to_thread
+import asyncio
+import atexit
+import hashlib
+import logging
 import os
+import queue
+import ssl
+
+def configure_logging():
+    """Route log records through a queue so handler I/O runs on a background thread"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    DefaultResponse = JSONResponse
 
 # Create static directory if it doesn't exist
 if not os.path.exists("static/product_images"):
     os.makedirs("static/product_images")
 
 # Create FastAPI application
-app = FastAPI(title=API_TITLE, version=API_VERSION)
+app = FastAPI(title=API_TITLE, version=API_VERSION, default_response_class=DefaultResponse)
 
-# Mount static files directory
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static files directory, unless a reverse proxy serves it
+if SERVE_STATIC_FILES:
+    app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Add CORS middleware
 app.add_middleware(
@@ -47,9 +93,35 @@ app.include_router(payments_router)
 app.include_router(conversations_router)
 app.include_router(chatbot_router)
 
+@app.on_event("startup")
+async def configure_threadpool():
+    """Let as many sync handlers run at once as the DB pool can serve (default is 40), and size the to_thread executor"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # asyncio.to_thread uses the loop's default executor, which is otherwise sized from the CPU count
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_SIZE, thread_name_prefix="asyncio")
+    )
+
+@app.on_event("startup")
+def log_crypto_backend():
+    """Log which OpenSSL build backs hashlib (SHA-NI support depends on it)"""
+    logger.info(
+        "hashlib backend: %s (sha256 available: %s)",
+        ssl.OPENSSL_VERSION, "sha256" in hashlib.algorithms_available
+    )
+
+def worker_count() -> int:
+    """Worker processes to run: API_WORKERS, else one per CPU core when Redis shares chat state, else one"""
+    if API_WORKERS is None:
+        return os.cpu_count() if redis_client is not None else 1
+    if API_WORKERS > 1 and redis_client is None:
+        # Each worker keeps its own chat contexts, so a user's turns can land on a worker that never saw the last one
+        logger.warning("API_WORKERS=%s without Redis: chatbot conversations won't carry over between workers; set REDIS_URL", API_WORKERS)
+    return API_WORKERS
+
 # Root endpoint
 @app.get("/")
-def read_root():
+async def read_root():
     return {
         "message": "Welcome to Online Shop API",
         "version": API_VERSION,
@@ -57,6 +129,18 @@ def read_root():
         "redoc": "/redoc"
     }
 
-if __name__ == "__main__":
+def run():
+    """Serve the API with uvicorn"""
     import uvicorn
-    uvicorn.run(app, host=API_HOST, port=API_PORT) 
\ No newline at end of file
+    # Workers need an import string; loop/http "auto" pick uvloop and httptools when installed
+    uvicorn.run(
+        "app.main:app",
+        host=API_HOST,
+        port=API_PORT,
+        workers=worker_count(),
+        loop="auto",
+        http="auto"
+    )
+
+if __name__ == "__main__":
+    run() 
\ No newline at end of file
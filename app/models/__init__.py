@@ -1,17 +1,17 @@
 # Models package for Online Shop API
 
 from .user import UserCreate, UserLogin, UserResponse
-from .product import CategoryCreate, CategoryResponse, ProductCreate, ProductResponse, ProductUpdate, ProductImageResponse
-from .order import CartItemCreate
-from .payment import PaymentCreate, PaymentStatusUpdate, PaymentResponse
+from .product import CategoryCreate, CategoryResponse, ProductCreate, ProductListItem, ProductResponse, ProductUpdate, ProductImageResponse
+from .order import CartItemCreate, OrderResponse, OrderItemResponse, OrderDetailResponse
+from .payment import PaymentMethod, PaymentStatus, PaymentCreate, PaymentStatusUpdate, PaymentResponse
 from .conversation import ConversationCreate
 from .chatbot import ChatMessage, ChatResponse, ProductRecommendation, ChatContext
 
 __all__ = [
     "UserCreate", "UserLogin", "UserResponse",
-    "CategoryCreate", "CategoryResponse", "ProductCreate", "ProductResponse", "ProductUpdate", "ProductImageResponse",
-    "CartItemCreate",
-    "PaymentCreate", "PaymentStatusUpdate", "PaymentResponse",
+    "CategoryCreate", "CategoryResponse", "ProductCreate", "ProductListItem", "ProductResponse", "ProductUpdate", "ProductImageResponse",
+    "CartItemCreate", "OrderResponse", "OrderItemResponse", "OrderDetailResponse",
+    "PaymentMethod", "PaymentStatus", "PaymentCreate", "PaymentStatusUpdate", "PaymentResponse",
     "ConversationCreate",
     "ChatMessage", "ChatResponse", "ProductRecommendation", "ChatContext"
 ] 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
 
@@ -10,6 +10,8 @@ class ActionPerformed(BaseModel):
     data: Optional[Dict[str, Any]] = None
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     response: str
     products: Optional[List[Dict[str, Any]]] = None
     actions_performed: Optional[List[Union[str, ActionPerformed]]] = None
@@ -1,8 +1,29 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, List
 
 class CartItemCreate(BaseModel):
     product_id: int
     quantity: int
  
 class OrderCreate(BaseModel):
-    cart_id: int 
\ No newline at end of file
+    cart_id: int
+
+class OrderResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    order_id: int
+    order_date: str
+    status: Optional[str]
+    total_amount: Optional[float]
+
+class OrderItemResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    product_id: int
+    product_name: Optional[str]
+    quantity: Optional[int]
+    price: Optional[float]
+    total: Optional[float]
+
+class OrderDetailResponse(OrderResponse):
+    items: List[OrderItemResponse]
@@ -1,14 +1,19 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Literal, Optional
+
+PaymentMethod = Literal['Momo', 'COD', 'Credit Card', 'ZaloPay']
+PaymentStatus = Literal['Paid', 'Unpaid', 'Failed', 'Refunded']
 
 class PaymentCreate(BaseModel):
     order_id: int
-    payment_method: str  # 'Momo', 'COD', 'Credit Card', 'ZaloPay'
+    payment_method: PaymentMethod
 
 class PaymentStatusUpdate(BaseModel):
-    payment_status: str  # 'Paid', 'Unpaid', 'Failed', 'Refunded'
+    payment_status: PaymentStatus
 
 class PaymentResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     payment_id: int
     order_id: int
     payment_method: str
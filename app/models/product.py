@@ -1,10 +1,12 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List
 
 class CategoryCreate(BaseModel):
     name: str
 
 class CategoryResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     category_id: int
     name: str
 
@@ -31,7 +33,20 @@ class ProductImageResponse(BaseModel):
     image_id: int
     image_url: str
 
+class ProductListItem(BaseModel):
+    """Catalog grid fields, returned by GET /products?view=summary"""
+    model_config = ConfigDict(frozen=True)
+
+    product_id: int
+    name: str
+    price: float
+    stock: int
+    image_path: Optional[str]
+    is_locked: bool
+
 class ProductResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     product_id: int
     name: str
     description: str
@@ -1,14 +1,14 @@
-from fastapi import APIRouter, HTTPException, status
+import pyodbc
+from fastapi import APIRouter, Depends, HTTPException, status
 from app.models import UserCreate, UserLogin
-from app.auth import hash_password, verify_password, create_access_token
-from app.database import get_connection
+from app.auth import hash_password, verify_password, password_needs_rehash, create_access_token, remember_user_role
+from app.database import get_db
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate):
+def register_user(user: UserCreate, conn: pyodbc.Connection = Depends(get_db)):
     """Register a new user"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -29,35 +29,38 @@ def register_user(user: UserCreate):
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.post("/login")
-def login_user(user: UserLogin):
+def login_user(user: UserLogin, conn: pyodbc.Connection = Depends(get_db)):
     """User login"""
-    conn = get_connection()
     cursor = conn.cursor()
     
-    try:
+    cursor.execute(
+        "SELECT UserID, Username, PasswordHash, Email, Role FROM Users WHERE Username = ?",
+        user.username
+    )
+    db_user = cursor.fetchone()
+    
+    if not db_user or not verify_password(user.password, db_user[2]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Upgrade legacy SHA256 hashes to bcrypt now that we have the plaintext
+    if password_needs_rehash(db_user[2]):
         cursor.execute(
-            "SELECT UserID, Username, PasswordHash, Email, Role FROM Users WHERE Username = ?",
-            user.username
+            "UPDATE Users SET PasswordHash = ? WHERE UserID = ?",
+            hash_password(user.password), db_user[0]
         )
-        db_user = cursor.fetchone()
-        
-        if not db_user or not verify_password(user.password, db_user[2]):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        access_token = create_access_token({"user_id": db_user[0], "username": db_user[1]})
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "user": {
-                "user_id": db_user[0],
-                "username": db_user[1],
-                "email": db_user[3],
-                "role": db_user[4]
-            }
+        conn.commit()
+    
+    remember_user_role(db_user[0], db_user[4])
+    access_token = create_access_token({"user_id": db_user[0], "username": db_user[1], "role": db_user[4]})
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user": {
+            "user_id": db_user[0],
+            "username": db_user[1],
+            "email": db_user[3],
+            "role": db_user[4]
         }
-    finally:
-        conn.close() 
\ No newline at end of file
+    }
\ No newline at end of file
@@ -1,87 +1,69 @@
+import pyodbc
 from fastapi import APIRouter, HTTPException, Depends, status
 from app.models import CartItemCreate
 from app.auth import get_current_user
-from app.database import get_connection
+from app.database import get_db, fetch_dicts
+from app.services.cart import get_or_create_cart_id
 
 router = APIRouter(prefix="/cart", tags=["Shopping Cart"])
 
+# Adds to the quantity of an existing line or inserts a new one
+MERGE_CART_ITEM_SQL = """
+    MERGE CartItems WITH (HOLDLOCK) AS t
+    USING (SELECT ? AS CartID, ? AS ProductID, ? AS Quantity) AS s
+    ON t.CartID = s.CartID AND t.ProductID = s.ProductID
+    WHEN MATCHED THEN
+        UPDATE SET t.Quantity = t.Quantity + s.Quantity
+    WHEN NOT MATCHED THEN
+        INSERT (CartID, ProductID, Quantity) VALUES (s.CartID, s.ProductID, s.Quantity);
+"""
+
 @router.get("")
-def get_user_cart(current_user_id: int = Depends(get_current_user)):
+def get_user_cart(current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Get user's shopping cart"""
-    conn = get_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get or create cart for user
-        cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", current_user_id)
-        cart = cursor.fetchone()
-        
-        if not cart:
-            cursor.execute("INSERT INTO Cart (UserID) VALUES (?)", current_user_id)
-            conn.commit()
-            cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", current_user_id)
-            cart = cursor.fetchone()
-        
-        cart_id = cart[0]
-        
-        # Get cart items
-        cursor.execute("""
-            SELECT ci.CartItemID, p.ProductID, p.Name, p.Price, ci.Quantity, (p.Price * ci.Quantity) as Total
-            FROM CartItems ci
-            JOIN Products p ON ci.ProductID = p.ProductID
-            WHERE ci.CartID = ?
-        """, cart_id)
-        
-        items = cursor.fetchall()
-        total_amount = sum(item[5] for item in items)
-        
-        return {
-            "cart_id": cart_id,
-            "items": [
-                {
-                    "cart_item_id": item[0],
-                    "product_id": item[1],
-                    "product_name": item[2],
-                    "price": float(item[3]),
-                    "quantity": item[4],
-                    "total": float(item[5])
-                } for item in items
-            ],
-            "total_amount": total_amount
-        }
-    finally:
-        conn.close()
+    # Get or create cart for user
+    cart_id = get_or_create_cart_id(cursor, current_user_id)
+    conn.commit()
+    
+    # Get cart items, with the cart total computed alongside by the server.
+    # Columns are aliased to the response keys so rows map straight to dicts.
+    cursor.execute("""
+        SELECT ci.CartItemID AS cart_item_id,
+               p.ProductID AS product_id,
+               p.Name AS product_name,
+               p.Price AS price,
+               ci.Quantity AS quantity,
+               p.Price * ci.Quantity AS total,
+               SUM(p.Price * ci.Quantity) OVER () AS cart_total
+        FROM CartItems ci
+        JOIN Products p ON ci.ProductID = p.ProductID
+        WHERE ci.CartID = ?
+    """, cart_id)
+    
+    items = fetch_dicts(cursor)
+    total_amount = 0
+    for item in items:
+        total_amount = item.pop("cart_total")
+    
+    return {
+        "cart_id": cart_id,
+        "items": items,
+        "total_amount": total_amount
+    }
 
 @router.post("/items", status_code=status.HTTP_201_CREATED)
-def add_to_cart(item: CartItemCreate, current_user_id: int = Depends(get_current_user)):
+def add_to_cart(item: CartItemCreate, current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Add item to cart"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
         # Get or create cart
-        cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", current_user_id)
-        cart = cursor.fetchone()
+        cart_id = get_or_create_cart_id(cursor, current_user_id)
         
-        if not cart:
-            cursor.execute("INSERT INTO Cart (UserID) VALUES (?)", current_user_id)
-            conn.commit()
-            cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", current_user_id)
-            cart = cursor.fetchone()
-        
-        cart_id = cart[0]
-        
-        # Check if item already exists in cart
-        cursor.execute("SELECT CartItemID, Quantity FROM CartItems WHERE CartID = ? AND ProductID = ?", cart_id, item.product_id)
-        existing_item = cursor.fetchone()
-        
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item[1] + item.quantity
-            cursor.execute("UPDATE CartItems SET Quantity = ? WHERE CartItemID = ?", new_quantity, existing_item[0])
-        else:
-            # Add new item
-            cursor.execute("INSERT INTO CartItems (CartID, ProductID, Quantity) VALUES (?, ?, ?)", cart_id, item.product_id, item.quantity)
+        # Add the item, or bump its quantity if it's already in the cart
+        cursor.execute(MERGE_CART_ITEM_SQL, cart_id, item.product_id, item.quantity)
         
         conn.commit()
         return {"message": "Item added to cart successfully"}
@@ -89,41 +71,34 @@ def add_to_cart(item: CartItemCreate, current_user_id: int = Depends(get_current
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.delete("/items/{cart_item_id}")
-def remove_from_cart(cart_item_id: int, current_user_id: int = Depends(get_current_user)):
+def remove_from_cart(cart_item_id: int, current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Remove item from cart"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Verify the cart item belongs to the user
+        # Ownership check is part of the DELETE itself
         cursor.execute("""
-            SELECT ci.CartItemID 
+            DELETE ci
             FROM CartItems ci
             JOIN Cart c ON ci.CartID = c.CartID
             WHERE ci.CartItemID = ? AND c.UserID = ?
         """, cart_item_id, current_user_id)
         
-        if not cursor.fetchone():
+        if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Cart item not found")
         
-        cursor.execute("DELETE FROM CartItems WHERE CartItemID = ?", cart_item_id)
         conn.commit()
         return {"message": "Item removed from cart successfully"}
     
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.put("/items/{cart_item_id}")
-def update_cart_item_quantity(cart_item_id: int, update_data: dict, current_user_id: int = Depends(get_current_user)):
+def update_cart_item_quantity(cart_item_id: int, update_data: dict, current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Update cart item quantity"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -131,37 +106,34 @@ def update_cart_item_quantity(cart_item_id: int, update_data: dict, current_user
         if not quantity or quantity <= 0:
             raise HTTPException(status_code=400, detail="Quantity must be greater than 0")
         
-        # Verify the cart item belongs to the user
+        # Ownership and stock checks are part of the UPDATE itself
         cursor.execute("""
-            SELECT ci.CartItemID, ci.ProductID
+            UPDATE ci
+            SET Quantity = ?
             FROM CartItems ci
             JOIN Cart c ON ci.CartID = c.CartID
-            WHERE ci.CartItemID = ? AND c.UserID = ?
-        """, cart_item_id, current_user_id)
-        
-        cart_item = cursor.fetchone()
-        if not cart_item:
-            raise HTTPException(status_code=404, detail="Cart item not found")
-        
-        product_id = cart_item[1]
-        
-        # Check if product has enough stock
-        cursor.execute("SELECT Stock FROM Products WHERE ProductID = ?", product_id)
-        product = cursor.fetchone()
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        if product[0] < quantity:
+            JOIN Products p ON ci.ProductID = p.ProductID
+            WHERE ci.CartItemID = ? AND c.UserID = ? AND p.Stock >= ?
+        """, quantity, cart_item_id, current_user_id, quantity)
+        
+        if cursor.rowcount == 0:
+            # Only the failure path pays for a second query to explain why
+            cursor.execute("""
+                SELECT p.Stock
+                FROM CartItems ci
+                JOIN Cart c ON ci.CartID = c.CartID
+                JOIN Products p ON ci.ProductID = p.ProductID
+                WHERE ci.CartItemID = ? AND c.UserID = ?
+            """, cart_item_id, current_user_id)
+            product = cursor.fetchone()
+            if not product:
+                raise HTTPException(status_code=404, detail="Cart item not found")
             raise HTTPException(status_code=400, detail=f"Insufficient stock. Available: {product[0]}")
         
-        # Update quantity
-        cursor.execute("UPDATE CartItems SET Quantity = ? WHERE CartItemID = ?", quantity, cart_item_id)
         conn.commit()
         
         return {"message": "Cart item quantity updated successfully"}
     
     except Exception as e:
         conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close() 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,43 +1,45 @@
+import pyodbc
 from fastapi import APIRouter, HTTPException, Depends, status
 from typing import List
+from pydantic import TypeAdapter
 from app.models import CategoryCreate, CategoryResponse
-from app.auth import get_current_user
-from app.database import get_connection
+from app.auth import CurrentUser, get_current_admin
+from app.cache import TTLCache
+from app.config import CATEGORY_CACHE_TTL_SECONDS
+from app.database import get_db, fetch_dicts, pool
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
+# Categories change only through the admin endpoint below, which clears this
+_categories_cache = TTLCache(maxsize=1, ttl=CATEGORY_CACHE_TTL_SECONDS)
+
+# Validates a whole result set in one pydantic-core call
+_CATEGORY_LIST_ADAPTER = TypeAdapter(List[CategoryResponse])
+
 @router.get("", response_model=List[CategoryResponse])
 def get_categories():
     """Get all categories"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("SELECT CategoryID, Name FROM Categories")
-        categories = cursor.fetchall()
-        return [CategoryResponse(category_id=cat[0], name=cat[1]) for cat in categories]
-    finally:
-        conn.close()
+    categories = _categories_cache.get("all")
+    if categories is None:
+        # Only borrow a connection on a cache miss
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT CategoryID AS category_id, Name AS name FROM Categories")
+            categories = _CATEGORY_LIST_ADAPTER.validate_python(fetch_dicts(cursor))
+        _categories_cache.set("all", categories)
+    return categories
 
 @router.post("", status_code=status.HTTP_201_CREATED)
-def create_category(category: CategoryCreate, current_user_id: int = Depends(get_current_user)):
+def create_category(category: CategoryCreate, current_user: CurrentUser = Depends(get_current_admin), conn: pyodbc.Connection = Depends(get_db)):
     """Create a new category (Admin only)"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if user is admin (role 2 or 3)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        if user_role < 2:
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
         cursor.execute("INSERT INTO Categories (Name) VALUES (?)", category.name)
         conn.commit()
+        _categories_cache.clear()
         return {"message": "Category created successfully"}
     
     except Exception as e:
         conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close() 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,22 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Set
+import asyncio
 import logging
+import pyodbc
 
 from app.auth import get_current_user
+from app.database import db_cursor
+from app.streaming import json_bytes
 from app.models.chatbot import ChatMessage, ChatResponse
 from app.services.improved_chatbot import ImprovedChatbotService
 
 router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
 security = HTTPBearer()
 
-# Use the improved chatbot service with conversation memory
-chatbot = ImprovedChatbotService()
+@lru_cache(maxsize=None)
+def get_chatbot() -> ImprovedChatbotService:
+    """Create the chatbot service on first use, once per worker"""
+    return ImprovedChatbotService()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Streamed chats still running; a strong reference keeps them alive after their client disconnects
+_running_chats: Set[asyncio.Task] = set()
+
+@router.on_event("startup")
+async def create_chatbot():
+    """Build the chatbot service off the event loop, so loading the intent model never stalls a request"""
+    await asyncio.to_thread(get_chatbot)
+
+@router.on_event("shutdown")
+async def close_chatbot():
+    """Let streamed chats and background saves finish, then release the service's HTTP client and threads"""
+    if get_chatbot.cache_info().currsize == 0:
+        return
+    await asyncio.gather(*_running_chats, return_exceptions=True)
+    await get_chatbot().aclose()
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_with_bot(
     message: ChatMessage,
@@ -28,10 +50,10 @@ async def chat_with_bot(
     try:
         user_id = current_user_id
         
-        logger.info(f"User {user_id} sent message: {message.message}")
+        logger.info("User %s sent message: %s", user_id, message.message)
         
         # Use the improved chatbot service
-        result = chatbot.chat(user_id, message.message)
+        result = await get_chatbot().chat(user_id, message.message)
         
         response = ChatResponse(
             response=result["response"],
@@ -40,21 +62,66 @@ async def chat_with_bot(
             conversation_id=result.get("conversation_id", 1)
         )
         
-        logger.info(f"Bot responded to user {user_id} with intent: {result.get('intent')}")
+        logger.info("Bot responded to user %s with intent: %s", user_id, result.get("intent"))
         
         return response
         
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.exception("Error in chat endpoint: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing chat message: {str(e)}"
         )
 
+@router.post("/chat/stream")
+async def chat_with_bot_stream(
+    message: ChatMessage,
+    current_user_id: int = Depends(get_current_user)
+):
+    """
+    Send a message to the AI chatbot and receive the reply as server-sent events:
+    "delta" events carry generated text as it arrives, and a final "done" event carries the full ChatResponse
+    """
+    user_id = current_user_id
+    logger.info("User %s sent streamed message: %s", user_id, message.message)
+    
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def on_delta(text: str):
+        await events.put(("delta", {"text": text}))
+    
+    async def run_chat():
+        try:
+            result = await get_chatbot().chat(user_id, message.message, on_delta)
+            response = ChatResponse(
+                response=result["response"],
+                products=result.get("products", []),
+                actions_performed=result.get("actions_performed", []),
+                conversation_id=result.get("conversation_id", 1)
+            )
+            await events.put(("done", response.model_dump()))
+        except Exception as e:
+            logger.exception("Error in streamed chat endpoint: %s", e)
+            await events.put(("error", {"detail": f"Error processing chat message: {str(e)}"}))
+    
+    async def event_stream():
+        # The chat keeps running if the client disconnects, so the turn is still saved
+        task = asyncio.create_task(run_chat())
+        _running_chats.add(task)
+        task.add_done_callback(_running_chats.discard)
+        while True:
+            event, data = await events.get()
+            yield b"event: " + event.encode() + b"\ndata: " + json_bytes(data) + b"\n\n"
+            if event != "delta":
+                break
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @router.get("/history")
-async def get_conversation_history(
+def get_conversation_history(
     limit: int = 10,
-    current_user_id: int = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user),
+    cursor: pyodbc.Cursor = Depends(db_cursor)
 ):
     """
     Get conversation history for the current user
@@ -62,22 +129,20 @@ async def get_conversation_history(
     try:
         user_id = current_user_id
         
-        from app.database import get_connection
-        conn = get_connection()
-        cursor = conn.cursor()
-        
+        # Newest N rows, returned oldest first so no reversal is needed in Python
         cursor.execute("""
-            SELECT TOP (?) ConversationID, Role, Message, CreatedAt
-            FROM Conversations 
-            WHERE UserID = ? 
-            ORDER BY CreatedAt DESC
+            SELECT ConversationID, Role, Message, CreatedAt
+            FROM (
+                SELECT TOP (?) ConversationID, Role, Message, CreatedAt
+                FROM Conversations 
+                WHERE UserID = ? 
+                ORDER BY CreatedAt DESC
+            ) recent
+            ORDER BY CreatedAt ASC
         """, (limit * 2, user_id))
         
-        results = cursor.fetchall()
-        conn.close()
-        
         conversations = []
-        for row in results:
+        for row in cursor:
             conversations.append({
                 "conversation_id": row[0],
                 "role": "user" if row[1] == 1 else "assistant",
@@ -86,12 +151,12 @@ async def get_conversation_history(
             })
         
         return {
-            "conversations": list(reversed(conversations)),
+            "conversations": conversations,
             "total": len(conversations)
         }
         
     except Exception as e:
-        logger.error(f"Error fetching history: {str(e)}")
+        logger.exception("Error fetching history: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error fetching conversation history: {str(e)}"
@@ -109,7 +174,7 @@ async def natural_language_product_search(
         user_id = current_user_id
         
         # Use improved chatbot for product search
-        result = chatbot.chat(user_id, message.message)
+        result = await get_chatbot().chat(user_id, message.message, wait_for_save=False)
         
         return {
             "query": message.message,
@@ -120,7 +185,7 @@ async def natural_language_product_search(
         }
         
     except Exception as e:
-        logger.error(f"Error in product search: {str(e)}")
+        logger.exception("Error in product search: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error searching products: {str(e)}"
@@ -138,7 +203,7 @@ async def cart_action(
         user_id = current_user_id
         
         # Process through chatbot
-        result = chatbot.chat(user_id, message.message)
+        result = await get_chatbot().chat(user_id, message.message, wait_for_save=False)
         
         # Check if it was a cart-related action
         cart_actions = ["add_to_cart", "remove_from_cart", "view_cart"]
@@ -158,7 +223,7 @@ async def cart_action(
             }
         
     except Exception as e:
-        logger.error(f"Error in cart action: {str(e)}")
+        logger.exception("Error in cart action: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing cart action: {str(e)}"
@@ -175,7 +240,7 @@ async def get_cart_contents(
         user_id = current_user_id
         
         # Use chatbot to get formatted cart contents
-        result = chatbot.chat(user_id, "show my cart")
+        result = await get_chatbot().chat(user_id, "show my cart", wait_for_save=False)
         
         return {
             "cart_summary": result["response"],
@@ -184,7 +249,7 @@ async def get_cart_contents(
         }
         
     except Exception as e:
-        logger.error(f"Error getting cart contents: {str(e)}")
+        logger.exception("Error getting cart contents: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving cart contents: {str(e)}"
@@ -202,7 +267,7 @@ async def quick_chat(
         user_id = current_user_id
         
         # Use the improved chatbot
-        result = chatbot.chat(user_id, message.message)
+        result = await get_chatbot().chat(user_id, message.message, wait_for_save=False)
         
         return {
             "response": result["response"],
@@ -211,7 +276,7 @@ async def quick_chat(
         }
         
     except Exception as e:
-        logger.error(f"Error in quick-chat endpoint: {str(e)}")
+        logger.exception("Error in quick-chat endpoint: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
@@ -227,10 +292,10 @@ async def reset_conversation(
     try:
         user_id = current_user_id
         
-        logger.info(f"User {user_id} requested conversation reset")
+        logger.info("User %s requested conversation reset", user_id)
         
         # Reset conversation using the improved chatbot service
-        result = chatbot.reset_conversation(user_id)
+        result = await get_chatbot().reset_conversation(user_id)
         
         response = ChatResponse(
             response=result["response"],
@@ -239,12 +304,12 @@ async def reset_conversation(
             conversation_id=result.get("conversation_id", None)
         )
         
-        logger.info(f"Reset conversation for user {user_id}, status: {result.get('status')}")
+        logger.info("Reset conversation for user %s, status: %s", user_id, result.get("status"))
         
         return response
         
     except Exception as e:
-        logger.error(f"Error in reset endpoint: {str(e)}")
+        logger.exception("Error in reset endpoint: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error"
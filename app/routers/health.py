@@ -1,10 +1,76 @@
+import asyncio
+import logging
 from fastapi import APIRouter
-from app.database import get_connection
+from app.config import HEALTH_SNAPSHOT_INTERVAL_SECONDS
+from app.database import pool
 
 router = APIRouter(tags=["Health"])
+logger = logging.getLogger(__name__)
+
+# Table list and approximate row counts (from partition metadata, not COUNT(*) scans)
+HEALTH_SNAPSHOT_SQL = """
+    SET NOCOUNT ON;
+    SELECT TABLE_NAME 
+    FROM INFORMATION_SCHEMA.TABLES 
+    WHERE TABLE_TYPE = 'BASE TABLE' 
+    AND TABLE_CATALOG = 'ShopDB'
+    ORDER BY TABLE_NAME;
+    
+    SET NOCOUNT OFF;
+    SELECT
+        (SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID('dbo.Users') AND index_id IN (0, 1)),
+        (SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID('dbo.Products') AND index_id IN (0, 1)),
+        (SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID('dbo.Categories') AND index_id IN (0, 1)),
+        (SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID('dbo.Payments') AND index_id IN (0, 1));
+"""
+
+# Latest table list and row counts, shared by every health poll
+_snapshot = {}
+_refresh_task = None
+
+def refresh_health_snapshot():
+    """Reload the table list and row counts served by /health/database"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(HEALTH_SNAPSHOT_SQL)
+        tables = [row[0] for row in cursor.fetchall()]
+        
+        cursor.nextset()
+        user_count, product_count, category_count, payment_count = cursor.fetchone()
+    
+    global _snapshot
+    _snapshot = {
+        "tables_found": tables,
+        "data_counts": {
+            "users": user_count,
+            "products": product_count,
+            "categories": category_count,
+            "payments": payment_count
+        }
+    }
+
+async def _refresh_health_loop():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_health_snapshot)
+        except Exception as e:
+            logger.warning("Health snapshot refresh failed: %s", e)
+        await asyncio.sleep(HEALTH_SNAPSHOT_INTERVAL_SECONDS)
+
+@router.on_event("startup")
+async def start_health_snapshots():
+    """Refresh the health snapshot in the background"""
+    global _refresh_task
+    _refresh_task = asyncio.create_task(_refresh_health_loop())
+
+@router.on_event("shutdown")
+async def stop_health_snapshots():
+    """Stop the background health snapshot refresh"""
+    if _refresh_task is not None:
+        _refresh_task.cancel()
 
 @router.get("/health")
-def health_check():
+async def health_check():
     """Basic API health check"""
     return {"status": "healthy", "message": "Online Shop API is running"}
 
@@ -12,52 +78,19 @@ def health_check():
 def database_health_check():
     """Check database connection and basic functionality"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Test basic connection
-        cursor.execute("SELECT 1 as test")
-        result = cursor.fetchone()
-        
-        # Test if database exists and has our tables
-        cursor.execute("""
-            SELECT TABLE_NAME 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_TYPE = 'BASE TABLE' 
-            AND TABLE_CATALOG = 'ShopDB'
-            ORDER BY TABLE_NAME
-        """)
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        # Test a simple query on Users table
-        cursor.execute("SELECT COUNT(*) as user_count FROM Users")
-        user_count = cursor.fetchone()[0]
-        
-        # Test a simple query on Products table
-        cursor.execute("SELECT COUNT(*) as product_count FROM Products")
-        product_count = cursor.fetchone()[0]
-        
-        # Test a simple query on Categories table
-        cursor.execute("SELECT COUNT(*) as category_count FROM Categories")
-        category_count = cursor.fetchone()[0]
-        
-        # Test a simple query on Payments table
-        cursor.execute("SELECT COUNT(*) as payment_count FROM Payments")
-        payment_count = cursor.fetchone()[0]
+        # Checked out inside the try so connection failures report as unhealthy
+        with pool.connection() as conn:
+            conn.cursor().execute("SELECT 1").fetchval()
         
-        conn.close()
+        # Table list and counts come from the background snapshot; load it now if it isn't ready yet
+        if not _snapshot:
+            refresh_health_snapshot()
         
         return {
             "status": "healthy",
             "message": "Database connection successful",
             "database": "ShopDB",
-            "tables_found": tables,
-            "data_counts": {
-                "users": user_count,
-                "products": product_count,
-                "categories": category_count,
-                "payments": payment_count
-            },
+            **_snapshot,
             "connection_details": {
                 "driver": "ODBC Driver 18 for SQL Server",
                 "server": "THANHAN\\MSSQLSERVER2019"
@@ -1,181 +1,156 @@
+import pyodbc
 from fastapi import APIRouter, HTTPException, Depends, status
-from app.auth import get_current_user
-from app.database import get_connection
+from typing import List
+from app.models import OrderResponse, OrderItemResponse, OrderDetailResponse
+from app.auth import CurrentUser, get_current_user, get_current_user_with_role, get_user_role
+from app.cache import get_product_names
+from app.database import db_cursor, get_db, get_read_db, prepared
+from app.streaming import stream_json_rows
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
+# Turns the user's cart into an order in one round trip. XACT_ABORT rolls the whole
+# batch back on any error. Returns (status, order_id): 0 = created, 1 = no cart, 2 = empty cart.
+CREATE_ORDER_SQL = """
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @UserID INT = ?;
+    DECLARE @CartID INT, @OrderID INT, @Status INT = 0;
+    
+    SELECT TOP (1) @CartID = CartID FROM Cart WHERE UserID = @UserID ORDER BY CartID;
+    
+    IF @CartID IS NULL
+        SET @Status = 1;
+    ELSE
+    BEGIN
+        INSERT INTO Orders (UserID, TotalAmount)
+        SELECT @UserID, SUM(ci.Quantity * p.Price)
+        FROM CartItems ci
+        JOIN Products p ON ci.ProductID = p.ProductID
+        WHERE ci.CartID = @CartID
+        HAVING COUNT(*) > 0;
+        
+        IF @@ROWCOUNT = 0
+            SET @Status = 2;
+        ELSE
+        BEGIN
+            SET @OrderID = SCOPE_IDENTITY();
+            
+            INSERT INTO OrderItems (OrderID, ProductID, Quantity, Price)
+            SELECT @OrderID, ci.ProductID, ci.Quantity, p.Price
+            FROM CartItems ci
+            JOIN Products p ON ci.ProductID = p.ProductID
+            WHERE ci.CartID = @CartID;
+            
+            DELETE FROM CartItems WHERE CartID = @CartID;
+        END;
+    END;
+    
+    SET XACT_ABORT OFF;
+    SET NOCOUNT OFF;
+    SELECT @Status, @OrderID;
+"""
+
+GET_USER_ORDERS_SQL = """
+    SELECT OrderID, OrderDate, Status, TotalAmount
+    FROM Orders
+    WHERE UserID = ?
+    ORDER BY OrderDate DESC
+"""
+
+# Two result sets in one call: the order header, then its items (empty unless the user owns the order).
+# Product names are filled in from the product name cache. See database/migrations/002_add_order_procedures.sql.
+GET_ORDER_DETAILS_SQL = "{CALL dbo.sp_GetOrderDetails(?, ?)}"
+
+# The order owner and its payment, if any
+GET_ORDER_PAYMENT_SQL = "{CALL dbo.sp_GetOrderAndPayment(?)}"
+
 @router.post("", status_code=status.HTTP_201_CREATED)
-def create_order(current_user_id: int = Depends(get_current_user)):
+def create_order(current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Create order from cart"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Get user's cart
-        cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", current_user_id)
-        cart = cursor.fetchone()
+        cursor.execute(CREATE_ORDER_SQL, current_user_id)
+        order_status, order_id = cursor.fetchone()
         
-        if not cart:
+        if order_status == 1:
             raise HTTPException(status_code=400, detail="No cart found")
-        
-        cart_id = cart[0]
-        
-        # Get cart items
-        cursor.execute("""
-            SELECT ci.ProductID, ci.Quantity, p.Price
-            FROM CartItems ci
-            JOIN Products p ON ci.ProductID = p.ProductID
-            WHERE ci.CartID = ?
-        """, cart_id)
-        
-        cart_items = cursor.fetchall()
-        
-        if not cart_items:
+        if order_status == 2:
             raise HTTPException(status_code=400, detail="Cart is empty")
         
-        # Calculate total amount
-        total_amount = sum(item[1] * item[2] for item in cart_items)
-        
-        # Create order
-        cursor.execute("INSERT INTO Orders (UserID, TotalAmount) VALUES (?, ?)", current_user_id, total_amount)
-        cursor.execute("SELECT @@IDENTITY")
-        order_id = cursor.fetchone()[0]
-        
-        # Create order items
-        for item in cart_items:
-            cursor.execute(
-                "INSERT INTO OrderItems (OrderID, ProductID, Quantity, Price) VALUES (?, ?, ?, ?)",
-                order_id, item[0], item[1], item[2]
-            )
-        
-        # Clear cart
-        cursor.execute("DELETE FROM CartItems WHERE CartID = ?", cart_id)
-        
         conn.commit()
         return {"message": "Order created successfully", "order_id": order_id}
     
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
-@router.get("")
+@router.get("", responses={200: {"model": List[OrderResponse]}})
 def get_user_orders(current_user_id: int = Depends(get_current_user)):
     """Get user's orders"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("""
-            SELECT OrderID, OrderDate, Status, TotalAmount
-            FROM Orders
-            WHERE UserID = ?
-            ORDER BY OrderDate DESC
-        """, current_user_id)
-        
-        orders = cursor.fetchall()
-        
-        return [
-            {
-                "order_id": order[0],
-                "order_date": str(order[1]),
-                "status": order[2],
-                "total_amount": float(order[3])
-            } for order in orders
-        ]
-    finally:
-        conn.close()
+    return stream_json_rows(GET_USER_ORDERS_SQL, (current_user_id,), lambda order: {
+        "order_id": order[0],
+        "order_date": str(order[1]),
+        "status": order[2],
+        "total_amount": order[3]
+    })
 
-@router.get("/{order_id}")
-def get_order_details(order_id: int, current_user_id: int = Depends(get_current_user)):
+@router.get("/{order_id}", response_model=OrderDetailResponse)
+def get_order_details(order_id: int, current_user_id: int = Depends(get_current_user), cursor: pyodbc.Cursor = Depends(db_cursor)):
     """Get order details"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor.execute(GET_ORDER_DETAILS_SQL, order_id, current_user_id)
+    order = cursor.fetchone()
     
-    try:
-        # Get order
-        cursor.execute("""
-            SELECT OrderID, OrderDate, Status, TotalAmount
-            FROM Orders
-            WHERE OrderID = ? AND UserID = ?
-        """, order_id, current_user_id)
-        
-        order = cursor.fetchone()
-        
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        # Get order items
-        cursor.execute("""
-            SELECT oi.ProductID, p.Name, oi.Quantity, oi.Price, (oi.Quantity * oi.Price) as Total
-            FROM OrderItems oi
-            JOIN Products p ON oi.ProductID = p.ProductID
-            WHERE oi.OrderID = ?
-        """, order_id)
-        
-        items = cursor.fetchall()
-        
-        return {
-            "order_id": order[0],
-            "order_date": str(order[1]),
-            "status": order[2],
-            "total_amount": float(order[3]),
-            "items": [
-                {
-                    "product_id": item[0],
-                    "product_name": item[1],
-                    "quantity": item[2],
-                    "price": float(item[3]),
-                    "total": float(item[4])
-                } for item in items
-            ]
-        }
-    finally:
-        conn.close()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Order items come back as the second result set
+    cursor.nextset()
+    items = cursor.fetchall()
+    product_names = get_product_names(cursor, (item[0] for item in items))
+    
+    return OrderDetailResponse(
+        order_id=order[0],
+        order_date=str(order[1]),
+        status=order[2],
+        total_amount=order[3],
+        items=[
+            OrderItemResponse(
+                product_id=item[0],
+                product_name=product_names.get(item[0]),
+                quantity=item[1],
+                price=item[2],
+                total=item[3]
+            ) for item in items
+        ]
+    )
 
 @router.get("/{order_id}/payment")
-def get_order_payment(order_id: int, current_user_id: int = Depends(get_current_user)):
+def get_order_payment(order_id: int, current_user: CurrentUser = Depends(get_current_user_with_role), conn: pyodbc.Connection = Depends(get_read_db)):
     """Get payment for specific order"""
-    conn = get_connection()
     cursor = conn.cursor()
     
-    try:
-        # Verify order belongs to user
-        cursor.execute("SELECT UserID FROM Orders WHERE OrderID = ?", order_id)
-        order = cursor.fetchone()
-        
-        if not order:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        # Check if user owns this order (or is admin)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        
-        if order[0] != current_user_id and user_role < 2:
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Get payment for this order
-        cursor.execute("""
-            SELECT PaymentID, OrderID, PaymentMethod, PaymentStatus, 
-                   TransactionCode, PaidAt
-            FROM Payments 
-            WHERE OrderID = ?
-        """, order_id)
-        
-        payment = cursor.fetchone()
-        
-        if not payment:
-            return {"message": "No payment found for this order", "order_id": order_id}
-        
-        return {
-            "payment_id": payment[0],
-            "order_id": payment[1],
-            "payment_method": payment[2],
-            "payment_status": payment[3],
-            "transaction_code": payment[4],
-            "paid_at": str(payment[5]) if payment[5] else None
-        }
+    # Fetch the order owner and the payment in one round trip
+    order = prepared(conn, GET_ORDER_PAYMENT_SQL).fetchone(order_id)
+    
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Check if user owns this order (or is admin, from the token's role claim)
+    if order[0] != current_user.user_id and get_user_role(cursor, current_user) < 2:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    payment = order[1:]
+    
+    if payment[0] is None:
+        return {"message": "No payment found for this order", "order_id": order_id}
     
-    finally:
-        conn.close() 
\ No newline at end of file
+    return {
+        "payment_id": payment[0],
+        "order_id": payment[1],
+        "payment_method": payment[2],
+        "payment_status": payment[3],
+        "transaction_code": payment[4],
+        "paid_at": str(payment[5]) if payment[5] else None
+    }
@@ -1,53 +1,129 @@
+import logging
+import pyodbc
 from fastapi import APIRouter, HTTPException, Depends, status
 from app.models import PaymentCreate, PaymentStatusUpdate, PaymentResponse
-from app.auth import get_current_user, generate_transaction_code
-from app.database import get_connection
+from app.auth import CurrentUser, get_current_user, get_current_user_with_role, get_user_role, generate_transaction_code, resolve_user_role
+from app.cache import product_detail_cache, product_list_cache
+from app.database import get_db, get_read_db, prepared
+from app.streaming import stream_json_rows
 
 router = APIRouter(prefix="/payments", tags=["Payments"])
+logger = logging.getLogger(__name__)
+
+# The caller's order and any payment already made for it
+GET_ORDER_FOR_PAYMENT_SQL = """
+    SELECT o.OrderID, o.TotalAmount, o.Status, p.PaymentID
+    FROM Orders o
+    LEFT JOIN Payments p ON p.OrderID = o.OrderID
+    WHERE o.OrderID = ? AND o.UserID = ?
+"""
+
+INSERT_PAYMENT_SQL = """
+    INSERT INTO Payments (OrderID, PaymentMethod, PaymentStatus, TransactionCode) 
+    OUTPUT INSERTED.PaymentID
+    VALUES (?, ?, 'Unpaid', ?)
+"""
+
+GET_PAYMENT_SQL = """
+    SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
+           p.TransactionCode, p.PaidAt, o.UserID
+    FROM Payments p
+    JOIN Orders o ON p.OrderID = o.OrderID
+    WHERE p.PaymentID = ?
+"""
+
+GET_PAYMENT_STATUS_SQL = """
+    SELECT p.PaymentID, p.OrderID, p.PaymentStatus, o.UserID
+    FROM Payments p
+    JOIN Orders o ON p.OrderID = o.OrderID
+    WHERE p.PaymentID = ?
+"""
+
+GET_ALL_PAYMENTS_SQL = """
+    SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
+           p.TransactionCode, p.PaidAt, o.UserID, u.Username, o.TotalAmount
+    FROM Payments p
+    JOIN Orders o ON p.OrderID = o.OrderID
+    JOIN Users u ON o.UserID = u.UserID
+    ORDER BY p.PaymentID DESC
+"""
+
+GET_USER_PAYMENTS_SQL = """
+    SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
+           p.TransactionCode, p.PaidAt, o.TotalAmount
+    FROM Payments p
+    JOIN Orders o ON p.OrderID = o.OrderID
+    WHERE o.UserID = ?
+    ORDER BY p.PaymentID DESC
+"""
+
+# Statements for a payment status change, joined into one batch by update_payment_status
+UPDATE_PAYMENT_SQL = """
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    UPDATE Payments
+    SET PaymentStatus = ?, PaidAt = CASE WHEN ? = 'Paid' THEN GETDATE() END
+    WHERE PaymentID = ?;
+"""
+
+SET_ORDER_STATUS_SQL = """
+    UPDATE Orders SET Status = ? WHERE OrderID = ?;
+"""
+
+# Reduce stock for every product in the order, clamping at 0. Runs after END_BATCH_SQL
+# so the OUTPUT rows (old stock per product) are the batch's first result set.
+DEDUCT_ORDER_STOCK_SQL = """
+    UPDATE p
+    SET p.Stock = CASE WHEN p.Stock >= oi.Quantity THEN p.Stock - oi.Quantity ELSE 0 END
+    OUTPUT deleted.ProductID, deleted.Stock, oi.Quantity
+    FROM Products p
+    JOIN (
+        SELECT ProductID, SUM(Quantity) AS Quantity
+        FROM OrderItems
+        WHERE OrderID = ?
+        GROUP BY ProductID
+    ) oi ON oi.ProductID = p.ProductID;
+"""
+
+RESTORE_ORDER_STOCK_SQL = """
+    UPDATE p
+    SET p.Stock = p.Stock + oi.Quantity
+    FROM Products p
+    JOIN (
+        SELECT ProductID, SUM(Quantity) AS Quantity
+        FROM OrderItems
+        WHERE OrderID = ?
+        GROUP BY ProductID
+    ) oi ON oi.ProductID = p.ProductID;
+"""
+
+END_BATCH_SQL = """
+    SET XACT_ABORT OFF;
+    SET NOCOUNT OFF;
+"""
 
 @router.post("", status_code=status.HTTP_201_CREATED)
-def create_payment(payment: PaymentCreate, current_user_id: int = Depends(get_current_user)):
+def create_payment(payment: PaymentCreate, current_user_id: int = Depends(get_current_user), conn: pyodbc.Connection = Depends(get_db)):
     """Create payment for an order"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Verify the order belongs to the user
-        cursor.execute("""
-            SELECT OrderID, TotalAmount, Status 
-            FROM Orders 
-            WHERE OrderID = ? AND UserID = ?
-        """, payment.order_id, current_user_id)
-        
-        order = cursor.fetchone()
+        # Verify the order belongs to the user, and see whether it's already paid for
+        order = prepared(conn, GET_ORDER_FOR_PAYMENT_SQL).fetchone(payment.order_id, current_user_id)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        order_id, total_amount, order_status = order
+        order_id, total_amount, order_status, existing_payment_id = order
         
         # Check if payment already exists for this order
-        cursor.execute("SELECT PaymentID FROM Payments WHERE OrderID = ?", order_id)
-        existing_payment = cursor.fetchone()
-        
-        if existing_payment:
+        if existing_payment_id is not None:
             raise HTTPException(status_code=400, detail="Payment already exists for this order")
         
-        # Validate payment method
-        valid_methods = ['Momo', 'COD', 'Credit Card', 'ZaloPay']
-        if payment.payment_method not in valid_methods:
-            raise HTTPException(status_code=400, detail=f"Invalid payment method. Valid methods: {valid_methods}")
-        
         # Generate transaction code
         transaction_code = generate_transaction_code(payment.payment_method)
         
         # Create payment record
-        cursor.execute("""
-            INSERT INTO Payments (OrderID, PaymentMethod, PaymentStatus, TransactionCode) 
-            VALUES (?, ?, 'Unpaid', ?)
-        """, order_id, payment.payment_method, transaction_code)
-        
-        cursor.execute("SELECT @@IDENTITY")
-        payment_id = cursor.fetchone()[0]
+        payment_id = cursor.execute(INSERT_PAYMENT_SQL, order_id, payment.payment_method, transaction_code).fetchval()
         
         conn.commit()
         
@@ -57,165 +133,91 @@ def create_payment(payment: PaymentCreate, current_user_id: int = Depends(get_cu
             "transaction_code": transaction_code,
             "order_id": order_id,
             "payment_method": payment.payment_method,
-            "amount": float(total_amount)
+            "amount": total_amount
         }
     
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.get("/{payment_id}", response_model=PaymentResponse)
-def get_payment(payment_id: int, current_user_id: int = Depends(get_current_user)):
+def get_payment(payment_id: int, current_user: CurrentUser = Depends(get_current_user_with_role), conn: pyodbc.Connection = Depends(get_read_db)):
     """Get payment details"""
-    conn = get_connection()
     cursor = conn.cursor()
     
-    try:
-        # Get payment with order verification
-        cursor.execute("""
-            SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
-                   p.TransactionCode, p.PaidAt, o.UserID
-            FROM Payments p
-            JOIN Orders o ON p.OrderID = o.OrderID
-            WHERE p.PaymentID = ?
-        """, payment_id)
-        
-        payment = cursor.fetchone()
-        
-        if not payment:
-            raise HTTPException(status_code=404, detail="Payment not found")
-        
-        # Check if user owns this payment (or is admin)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        
-        if payment[6] != current_user_id and user_role < 2:  # payment[6] is UserID from order
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        return PaymentResponse(
-            payment_id=payment[0],
-            order_id=payment[1],
-            payment_method=payment[2],
-            payment_status=payment[3],
-            transaction_code=payment[4],
-            paid_at=str(payment[5]) if payment[5] else None
-        )
+    # Get payment with order verification
+    payment = prepared(conn, GET_PAYMENT_SQL).fetchone(payment_id)
+    
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    
+    # Check if user owns this payment (or is admin, from the token's role claim)
+    if payment[6] != current_user.user_id and get_user_role(cursor, current_user) < 2:  # payment[6] is UserID from order
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    finally:
-        conn.close()
+    return PaymentResponse(
+        payment_id=payment[0],
+        order_id=payment[1],
+        payment_method=payment[2],
+        payment_status=payment[3],
+        transaction_code=payment[4],
+        paid_at=str(payment[5]) if payment[5] else None
+    )
+
 
 @router.put("/{payment_id}/status")
-def update_payment_status(payment_id: int, status_update: PaymentStatusUpdate, current_user_id: int = Depends(get_current_user)):
+def update_payment_status(payment_id: int, status_update: PaymentStatusUpdate, current_user: CurrentUser = Depends(get_current_user_with_role), conn: pyodbc.Connection = Depends(get_db)):
     """Update payment status"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
         # Get payment with order verification
-        cursor.execute("""
-            SELECT p.PaymentID, p.OrderID, p.PaymentStatus, o.UserID
-            FROM Payments p
-            JOIN Orders o ON p.OrderID = o.OrderID
-            WHERE p.PaymentID = ?
-        """, payment_id)
-        
-        payment = cursor.fetchone()
+        payment = prepared(conn, GET_PAYMENT_STATUS_SQL).fetchone(payment_id)
         
         if not payment:
             raise HTTPException(status_code=404, detail="Payment not found")
         
-        # Check if user owns this payment (or is admin)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        
-        if payment[3] != current_user_id and user_role < 2:  # payment[3] is UserID from order
+        # Check if user owns this payment (or is admin, from the token's role claim)
+        if payment[3] != current_user.user_id and get_user_role(cursor, current_user) < 2:  # payment[3] is UserID from order
             raise HTTPException(status_code=403, detail="Access denied")
         
-        # Validate payment status
-        valid_statuses = ['Paid', 'Unpaid', 'Failed', 'Refunded']
-        if status_update.payment_status not in valid_statuses:
-            raise HTTPException(status_code=400, detail=f"Invalid payment status. Valid statuses: {valid_statuses}")
-        
         current_status = payment[2]
         order_id = payment[1]
         
-        # Update payment status
-        paid_at = "GETDATE()" if status_update.payment_status == 'Paid' else "NULL"
-        cursor.execute(f"""
-            UPDATE Payments 
-            SET PaymentStatus = ?, PaidAt = {paid_at}
-            WHERE PaymentID = ?
-        """, status_update.payment_status, payment_id)
+        # Payment update, order status and stock changes go to the server as one batch
+        new_status = status_update.payment_status
+        sql = UPDATE_PAYMENT_SQL
+        params = [new_status, new_status, payment_id]
+        deduct_stock = new_status == 'Paid' and current_status != 'Paid'
         
         # Update order status based on payment status
-        if status_update.payment_status == 'Paid' and current_status != 'Paid':
-            print(f"DEBUG: Processing payment {payment_id} for order {order_id} - marking as Paid")
-            cursor.execute("UPDATE Orders SET Status = 'Confirmed' WHERE OrderID = ?", order_id)
-            
-            # Reduce stock for each product in the order
-            cursor.execute("""
-                SELECT oi.ProductID, oi.Quantity
-                FROM OrderItems oi
-                WHERE oi.OrderID = ?
-            """, order_id)
-            
-            order_items = cursor.fetchall()
-            print(f"DEBUG: Found {len(order_items)} order items to process")
-            
-            for product_id, quantity in order_items:
-                print(f"DEBUG: Processing product {product_id}, quantity {quantity}")
-                # Check if product has enough stock
-                cursor.execute("SELECT Stock FROM Products WHERE ProductID = ?", product_id)
-                stock_result = cursor.fetchone()
-                
-                if stock_result:
-                    current_stock = stock_result[0]
-                    print(f"DEBUG: Product {product_id} current stock: {current_stock}")
-                    if current_stock >= quantity:
-                        # Reduce stock
-                        cursor.execute("""
-                            UPDATE Products 
-                            SET Stock = Stock - ? 
-                            WHERE ProductID = ?
-                        """, quantity, product_id)
-                        print(f"DEBUG: Reduced stock for product {product_id} by {quantity}")
-                    else:
-                        # Log warning but don't fail the payment - could be handled differently
-                        print(f"Warning: Insufficient stock for product {product_id}. Stock: {current_stock}, Ordered: {quantity}")
-                        # Still reduce stock to 0 or handle as needed
-                        cursor.execute("""
-                            UPDATE Products 
-                            SET Stock = 0 
-                            WHERE ProductID = ?
-                        """, product_id)
-                        print(f"DEBUG: Set stock to 0 for product {product_id}")
-                else:
-                    print(f"DEBUG: Product {product_id} not found!")
-            
-        elif status_update.payment_status == 'Failed':
-            cursor.execute("UPDATE Orders SET Status = 'Cancelled' WHERE OrderID = ?", order_id)
-        elif status_update.payment_status == 'Refunded':
-            cursor.execute("UPDATE Orders SET Status = 'Refunded' WHERE OrderID = ?", order_id)
-            
+        if deduct_stock:
+            logger.debug("Processing payment %s for order %s - marking as Paid", payment_id, order_id)
+            sql += SET_ORDER_STATUS_SQL + END_BATCH_SQL + DEDUCT_ORDER_STOCK_SQL
+            params += ['Confirmed', order_id, order_id]
+        elif new_status == 'Failed':
+            sql += SET_ORDER_STATUS_SQL + END_BATCH_SQL
+            params += ['Cancelled', order_id]
+        elif new_status == 'Refunded':
             # Restore stock when refunded
-            cursor.execute("""
-                SELECT oi.ProductID, oi.Quantity
-                FROM OrderItems oi
-                WHERE oi.OrderID = ?
-            """, order_id)
-            
-            order_items = cursor.fetchall()
-            
-            for product_id, quantity in order_items:
-                cursor.execute("""
-                    UPDATE Products 
-                    SET Stock = Stock + ? 
-                    WHERE ProductID = ?
-                """, quantity, product_id)
+            sql += SET_ORDER_STATUS_SQL + RESTORE_ORDER_STOCK_SQL + END_BATCH_SQL
+            params += ['Refunded', order_id, order_id]
+        else:
+            sql += END_BATCH_SQL
+        
+        cursor.execute(sql, params)
+        
+        if deduct_stock:
+            for product_id, stock, quantity in cursor.fetchall():
+                if stock < quantity:
+                    # Log warning but don't fail the payment - could be handled differently
+                    logger.warning("Insufficient stock for product %s. Stock: %s, Ordered: %s", product_id, stock, quantity)
         
         conn.commit()
+        if deduct_stock or new_status == 'Refunded':
+            # Stock is part of the cached product list and product details
+            product_list_cache.clear()
+            product_detail_cache.clear()
         
         return {
             "message": "Payment status updated successfully",
@@ -226,68 +228,32 @@ def update_payment_status(payment_id: int, status_update: PaymentStatusUpdate, c
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.get("")
-def get_user_payments(current_user_id: int = Depends(get_current_user)):
+def get_user_payments(current_user: CurrentUser = Depends(get_current_user_with_role)):
     """Get user's payments (admin sees all)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Check if user is admin
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        
-        if user_role >= 2:  # Admin can see all payments
-            cursor.execute("""
-                SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
-                       p.TransactionCode, p.PaidAt, o.UserID, u.Username, o.TotalAmount
-                FROM Payments p
-                JOIN Orders o ON p.OrderID = o.OrderID
-                JOIN Users u ON o.UserID = u.UserID
-                ORDER BY p.PaymentID DESC
-            """)
-            
-            payments = cursor.fetchall()
-            
-            return [
-                {
-                    "payment_id": payment[0],
-                    "order_id": payment[1],
-                    "payment_method": payment[2],
-                    "payment_status": payment[3],
-                    "transaction_code": payment[4],
-                    "paid_at": str(payment[5]) if payment[5] else None,
-                    "user_id": payment[6],
-                    "username": payment[7],
-                    "amount": float(payment[8])
-                } for payment in payments
-            ]
-        else:  # Regular user sees only their payments
-            cursor.execute("""
-                SELECT p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus, 
-                       p.TransactionCode, p.PaidAt, o.TotalAmount
-                FROM Payments p
-                JOIN Orders o ON p.OrderID = o.OrderID
-                WHERE o.UserID = ?
-                ORDER BY p.PaymentID DESC
-            """, current_user_id)
-            
-            payments = cursor.fetchall()
-            
-            return [
-                {
-                    "payment_id": payment[0],
-                    "order_id": payment[1],
-                    "payment_method": payment[2],
-                    "payment_status": payment[3],
-                    "transaction_code": payment[4],
-                    "paid_at": str(payment[5]) if payment[5] else None,
-                    "amount": float(payment[6])
-                } for payment in payments
-            ]
-    
-    finally:
-        conn.close() 
\ No newline at end of file
+    # Check if user is admin, from the token's role claim; the streamed list takes its own connection,
+    # so none is held here while it waits for one
+    role = resolve_user_role(current_user)
+    if role is not None and role >= 2:  # Admin can see all payments
+        return stream_json_rows(GET_ALL_PAYMENTS_SQL, (), lambda payment: {
+            "payment_id": payment[0],
+            "order_id": payment[1],
+            "payment_method": payment[2],
+            "payment_status": payment[3],
+            "transaction_code": payment[4],
+            "paid_at": str(payment[5]) if payment[5] else None,
+            "user_id": payment[6],
+            "username": payment[7],
+            "amount": payment[8]
+        })
+    else:  # Regular user sees only their payments
+        return stream_json_rows(GET_USER_PAYMENTS_SQL, (current_user.user_id,), lambda payment: {
+            "payment_id": payment[0],
+            "order_id": payment[1],
+            "payment_method": payment[2],
+            "payment_status": payment[3],
+            "transaction_code": payment[4],
+            "paid_at": str(payment[5]) if payment[5] else None,
+            "amount": payment[6]
+        })
@@ -1,86 +1,234 @@
-from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile, Form
-from typing import List, Optional
-from app.models import ProductCreate, ProductResponse, ProductUpdate, ProductImageResponse
-from app.auth import get_current_user
-from app.database import get_connection
+import hashlib
+import logging
+import pyodbc
+from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile, Form, Header, Query, Response
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Literal, Optional, Tuple, Union
+from app.models import ProductCreate, ProductListItem, ProductResponse, ProductUpdate, ProductImageResponse
+from app.auth import CurrentUser, get_current_admin
+from app.cache import forget_product_name, product_detail_cache, product_list_cache
+from app.config import PRODUCT_PAGE_MAX_LIMIT, UPLOAD_COPY_BUFFER_SIZE, UPLOAD_SAVE_WORKERS
+from app.database import get_db, get_read_db, pool, prepared
+from app.streaming import json_bytes
 import os
 import shutil
+import uuid
 
 router = APIRouter(prefix="/products", tags=["Products"])
+logger = logging.getLogger(__name__)
 
-@router.get("", response_model=List[ProductResponse])
-def get_products():
-    """Get all products"""
-    conn = get_connection()
-    cursor = conn.cursor()
+# Shared by all requests so parallel saves can't multiply threads without bound
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_SAVE_WORKERS, thread_name_prefix="upload")
+
+GET_PRODUCTS_WITH_IMAGES_SQL = """
+    SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID, CreatedAt, IsLocked, ImagePath FROM Products;
+    SELECT ProductID, ImageID, ImageURL FROM ProductImages;
+"""
+
+# Just the catalog grid fields: no description and no image rows
+GET_PRODUCT_SUMMARIES_SQL = "SELECT ProductID, Name, Price, Stock, ImagePath, IsLocked FROM Products"
+
+GET_PRODUCT_SUMMARY_PAGE_SQL = """
+    SELECT ProductID, Name, Price, Stock, ImagePath, IsLocked
+    FROM Products
+    ORDER BY ProductID
+    OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+"""
+
+GET_PRODUCT_SQL = """
+    SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID, CreatedAt, IsLocked, ImagePath
+    FROM Products
+    WHERE ProductID = ?
+"""
+
+GET_PRODUCT_IMAGES_SQL = "SELECT ImageID, ImageURL FROM ProductImages WHERE ProductID = ?"
+
+# One page of products by ProductID, and the images of just that page
+GET_PRODUCT_PAGE_WITH_IMAGES_SQL = """
+    SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID, CreatedAt, IsLocked, ImagePath
+    FROM Products
+    ORDER BY ProductID
+    OFFSET ? ROWS FETCH NEXT ? ROWS ONLY;
     
-    try:
-        cursor.execute(
-            "SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID, CreatedAt, IsLocked, ImagePath FROM Products"
-        )
-        products = cursor.fetchall()
-        
-        product_responses = []
-        for prod in products:
-            product_id = prod[0]
-            cursor.execute("SELECT ImageID, ImageURL FROM ProductImages WHERE ProductID = ?", product_id)
-            images = cursor.fetchall()
-            image_responses = [ProductImageResponse(image_id=img[0], image_url=img[1]) for img in images]
-            
-            product_responses.append(ProductResponse(
-                product_id=product_id,
-                name=prod[1],
-                description=prod[2],
-                price=float(prod[3]),
-                stock=prod[4],
-                color=prod[5],
-                style=prod[6],
-                category_id=prod[7],
-                created_at=str(prod[8]),
-                is_locked=prod[9],
-                image_path=prod[10],
-                images=image_responses
-            ))
-        return product_responses
-    finally:
-        conn.close()
+    SELECT pi.ProductID, pi.ImageID, pi.ImageURL
+    FROM ProductImages pi
+    JOIN (
+        SELECT ProductID FROM Products
+        ORDER BY ProductID
+        OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+    ) page ON page.ProductID = pi.ProductID;
+"""
+
+@lru_cache(maxsize=256)
+def _update_product_sql(columns: Tuple[str, ...]) -> str:
+    # One SQL text per set of updated columns, so repeated update shapes reuse their cached plan
+    return f"UPDATE Products SET {', '.join(f'{column}=?' for column in columns)} WHERE ProductID=?"
+
+def insert_product_images(cursor: pyodbc.Cursor, product_id: int, image_urls: List[str], set_primary: bool = False):
+    """Insert a product's image rows, and optionally make the first its ImagePath, in one round trip"""
+    # NOCOUNT suppresses a DONE token per statement; it persists on pooled sessions, so turn it back off
+    sql = "SET NOCOUNT ON; INSERT INTO ProductImages (ProductID, ImageURL) VALUES " + ", ".join(["(?, ?)"] * len(image_urls)) + ";"
+    params = [value for image_url in image_urls for value in (product_id, image_url)]
+    if set_primary:
+        sql += " UPDATE Products SET ImagePath = ? WHERE ProductID = ?;"
+        params += [image_urls[0], product_id]
+    cursor.execute(sql + " SET NOCOUNT OFF;", params)
+
+def _sendfile(src, dst):
+    # sendfile with an explicit offset leaves src's position untouched, so a failed attempt can fall back cleanly
+    src_fd = src.fileno()
+    offset = src.tell()
+    size = os.fstat(src_fd).st_size
+    while offset < size:
+        sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+def save_upload(file: UploadFile, file_path: str):
+    """Write an uploaded file to disk, zero-copy when the upload has spilled to a temp file"""
+    with open(file_path, "wb") as out:
+        # Only rolled-over spooled files have a real descriptor; fileno() on an in-memory one would force a spill
+        if hasattr(os, "sendfile") and getattr(file.file, "_rolled", False):
+            try:
+                _sendfile(file.file, out)
+                return
+            except OSError:
+                out.seek(0)
+                out.truncate()
+        shutil.copyfileobj(file.file, out, UPLOAD_COPY_BUFFER_SIZE)
+
+def _upload_path(product_id: int, filename: str) -> str:
+    # Client filenames are untrusted: keep only a short alphanumeric extension under a random name,
+    # so a re-upload never overwrites an image a row (or a long-lived client cache) still points at;
+    # sharded into 256 subdirectories so no directory grows with the whole catalog
+    name = uuid.uuid4().hex
+    ext = os.path.splitext(filename)[1][:8]
+    if not (ext[1:].isascii() and ext[1:].isalnum()):
+        ext = ""
+    shard_dir = f"static/product_images/{name[:2]}"
+    os.makedirs(shard_dir, exist_ok=True)
+    return f"{shard_dir}/{product_id}_{name}{ext}"
+
+def save_uploads(product_id: int, files: List[UploadFile]) -> List[str]:
+    """Save a product's uploaded images in parallel and return their URLs in upload order"""
+    file_paths = [_upload_path(product_id, file.filename or "") for file in files]
+    list(_upload_executor.map(save_upload, files, file_paths))
+    # Use forward slashes for URL
+    return [file_path.replace("\\", "/") for file_path in file_paths]
+
+def _load_products(cursor: pyodbc.Cursor, sql: str = GET_PRODUCTS_WITH_IMAGES_SQL, params: tuple = ()) -> List[dict]:
+    # Products and their images in one batch, instead of one image query per product
+    cursor.execute(sql, *params)
+    products = cursor.fetchall()
+    
+    cursor.nextset()
+    images_by_product = defaultdict(list)
+    for product_id, image_id, image_url in cursor.fetchall():
+        images_by_product[product_id].append({"image_id": image_id, "image_url": image_url})
+    
+    # Plain dicts in ProductResponse's shape; the rows are already typed, so skip per-model validation
+    return [
+        {
+            "product_id": prod[0],
+            "name": prod[1],
+            "description": prod[2],
+            "price": prod[3],
+            "stock": prod[4],
+            "color": prod[5],
+            "style": prod[6],
+            "category_id": prod[7],
+            "created_at": str(prod[8]),
+            "is_locked": prod[9],
+            "image_path": prod[10],
+            "images": images_by_product.get(prod[0], [])
+        } for prod in products
+    ]
+
+def _load_product_summaries(cursor: pyodbc.Cursor, sql: str = GET_PRODUCT_SUMMARIES_SQL, params: tuple = ()) -> List[dict]:
+    cursor.execute(sql, *params)
+    return [
+        {
+            "product_id": prod[0],
+            "name": prod[1],
+            "price": prod[2],
+            "stock": prod[3],
+            "image_path": prod[4],
+            "is_locked": prod[5]
+        } for prod in cursor.fetchall()
+    ]
+
+@router.get("", response_model=Union[List[ProductResponse], List[ProductListItem]])
+def get_products(
+    view: Literal["full", "summary"] = "full",
+    limit: Optional[int] = Query(None, ge=1, le=PRODUCT_PAGE_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get all products, or one page of them when limit is given (view=summary returns grid fields only)"""
+    if limit is not None:
+        return _get_product_page(view, limit, offset)
+    
+    cached = product_list_cache.get(view)
+    if cached is None:
+        # Only borrow a connection on a cache miss
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            products = _load_product_summaries(cursor) if view == "summary" else _load_products(cursor)
+        body = json_bytes(products)
+        cached = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+        product_list_cache.set(view, cached)
+    
+    body, etag = cached
+    # Clients and proxies may keep the body but must revalidate; a matching ETag costs no DB work
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _get_product_page(view: str, limit: int, offset: int) -> Response:
+    # Ask for one extra row to learn whether another page follows
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        if view == "summary":
+            products = _load_product_summaries(cursor, GET_PRODUCT_SUMMARY_PAGE_SQL, (offset, limit + 1))
+        else:
+            products = _load_products(cursor, GET_PRODUCT_PAGE_WITH_IMAGES_SQL, (offset, limit + 1, offset, limit + 1))
+    
+    # Same list body as the full catalog, so existing clients can page without a new response shape
+    headers = {}
+    if len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Offset"] = str(offset + limit)
+    return Response(content=json_bytes(products), media_type="application/json", headers=headers)
 
 @router.get("/{product_id}", response_model=ProductResponse)
-def get_product(product_id: int):
+def get_product(product_id: int, conn: pyodbc.Connection = Depends(get_read_db)):
     """Get a specific product by ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    product = prepared(conn, GET_PRODUCT_SQL).fetchone(product_id)
     
-    try:
-        cursor.execute(
-            "SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID, CreatedAt, IsLocked, ImagePath FROM Products WHERE ProductID = ?",
-            product_id
-        )
-        product = cursor.fetchone()
-        
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        cursor.execute("SELECT ImageID, ImageURL FROM ProductImages WHERE ProductID = ?", product_id)
-        images = cursor.fetchall()
-        image_responses = [ProductImageResponse(image_id=img[0], image_url=img[1]) for img in images]
-
-        return ProductResponse(
-            product_id=product[0],
-            name=product[1],
-            description=product[2],
-            price=float(product[3]),
-            stock=product[4],
-            color=product[5],
-            style=product[6],
-            category_id=product[7],
-            created_at=str(product[8]),
-            is_locked=product[9],
-            image_path=product[10],
-            images=image_responses
-        )
-    finally:
-        conn.close()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    images = prepared(conn, GET_PRODUCT_IMAGES_SQL).fetchall(product_id)
+    image_responses = [ProductImageResponse(image_id=img[0], image_url=img[1]) for img in images]
+
+    return ProductResponse(
+        product_id=product[0],
+        name=product[1],
+        description=product[2],
+        price=product[3],
+        stock=product[4],
+        color=product[5],
+        style=product[6],
+        category_id=product[7],
+        created_at=str(product[8]),
+        is_locked=product[9],
+        image_path=product[10],
+        images=image_responses
+    )
 
 @router.post("", status_code=status.HTTP_201_CREATED)
 def create_product(
@@ -92,54 +240,33 @@ def create_product(
     style: str = Form(...),
     category_id: int = Form(...),
     files: List[UploadFile] = File(...),
-    current_user_id: int = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_admin),
+    conn: pyodbc.Connection = Depends(get_db)
 ):
     """Create a new product with images (Admin only)"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if user is admin (role 2 or 3)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        if user_role < 2:
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
         # Insert product
-        cursor.execute(
+        product_id = cursor.execute(
             "INSERT INTO Products (Name, Description, Price, Stock, Color, Style, CategoryID) OUTPUT INSERTED.ProductID VALUES (?, ?, ?, ?, ?, ?, ?)",
             name, description, price, stock, color, style, category_id
-        )
-        product_id = cursor.fetchone()[0]
+        ).fetchval()
 
         # Handle image uploads
-        image_urls = []
-        for file in files:
-            file_path = f"static/product_images/{product_id}_{file.filename}"
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # Use forward slashes for URL
-            image_url = file_path.replace("\\", "/")
-            image_urls.append(image_url)
-            
-            cursor.execute(
-                "INSERT INTO ProductImages (ProductID, ImageURL) VALUES (?, ?)",
-                product_id, image_url
-            )
-
-        # Set primary image path
+        image_urls = save_uploads(product_id, files)
+
+        # Save image rows and set primary image path
         if image_urls:
-            cursor.execute("UPDATE Products SET ImagePath = ? WHERE ProductID = ?", image_urls[0], product_id)
+            insert_product_images(cursor, product_id, image_urls, set_primary=True)
 
         conn.commit()
+        product_list_cache.clear()
         return {"message": "Product created successfully", "product_id": product_id, "image_urls": image_urls}
     
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.put("/{product_id}")
 def update_product(
@@ -153,19 +280,13 @@ def update_product(
     category_id: Optional[int] = Form(None),
     is_locked: Optional[bool] = Form(None),
     files: Optional[List[UploadFile]] = File(None),
-    current_user_id: int = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_admin),
+    conn: pyodbc.Connection = Depends(get_db)
 ):
     """Update a product (Admin only)"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if user is admin (role 2 or 3)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        if user_role < 2:
-            raise HTTPException(status_code=403, detail="Admin access required")
-
         # Create a dictionary of fields to update
         update_data = {
             "Name": name, "Description": description, "Price": price, "Stock": stock,
@@ -174,93 +295,67 @@ def update_product(
         update_data = {k: v for k, v in update_data.items() if v is not None}
 
         if update_data:
-            set_clause = ", ".join([f"{key}=?" for key in update_data.keys()])
-            values = list(update_data.values())
+            # Column names come from the fixed dict above, never from the request
+            columns = tuple(sorted(update_data))
+            values = [update_data[column] for column in columns]
             values.append(product_id)
 
-            cursor.execute(f"UPDATE Products SET {set_clause} WHERE ProductID=?", values)
+            cursor.execute(_update_product_sql(columns), values)
 
         # Handle new image uploads
         if files:
-            image_urls = []
-            for file in files:
-                file_path = f"static/product_images/{product_id}_{file.filename}"
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                
-                image_url = file_path.replace("\\", "/")
-                image_urls.append(image_url)
-                
-                cursor.execute(
-                    "INSERT INTO ProductImages (ProductID, ImageURL) VALUES (?, ?)",
-                    product_id, image_url
-                )
+            image_urls = save_uploads(product_id, files)
+            insert_product_images(cursor, product_id, image_urls)
 
         if not update_data and not files:
             raise HTTPException(status_code=400, detail="No fields to update")
 
         conn.commit()
+        product_list_cache.clear()
+        product_detail_cache.pop(product_id)
+        if "Name" in update_data:
+            forget_product_name(product_id)
         return {"message": "Product updated successfully"}
     
     except Exception as e:
         conn.rollback()
-        print(f"ERROR updating product {product_id}: {e}")
-        import traceback
-        print(f"ERROR traceback: {traceback.format_exc()}")
+        logger.exception("Error updating product %s", product_id)
         raise HTTPException(status_code=500, detail=f"Error updating product: {str(e)}")
-    finally:
-        conn.close()
 
 @router.patch("/{product_id}/lock", status_code=status.HTTP_200_OK)
-def lock_product(product_id: int, current_user_id: int = Depends(get_current_user)):
+def lock_product(product_id: int, current_user: CurrentUser = Depends(get_current_admin), conn: pyodbc.Connection = Depends(get_db)):
     """Lock a product to prevent deletion (Admin only)"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if user is admin (role 2 or 3)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        if user_role < 2:
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
         cursor.execute("UPDATE Products SET IsLocked = 1 WHERE ProductID = ?", product_id)
         
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Product not found")
         
         conn.commit()
+        product_list_cache.clear()
         return {"message": "Product locked successfully"}
     
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.patch("/{product_id}/unlock", status_code=status.HTTP_200_OK)
-def unlock_product(product_id: int, current_user_id: int = Depends(get_current_user)):
+def unlock_product(product_id: int, current_user: CurrentUser = Depends(get_current_admin), conn: pyodbc.Connection = Depends(get_db)):
     """Unlock a product to allow deletion (Admin only)"""
-    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if user is admin (role 2 or 3)
-        cursor.execute("SELECT Role FROM Users WHERE UserID = ?", current_user_id)
-        user_role = cursor.fetchone()[0]
-        if user_role < 2:
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
         cursor.execute("UPDATE Products SET IsLocked = 0 WHERE ProductID = ?", product_id)
         
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Product not found")
         
         conn.commit()
+        product_list_cache.clear()
         return {"message": "Product unlocked successfully"}
     
     except Exception as e:
         conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close() 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+class AsyncMicroBatcher:
+    """
+    Collects calls that arrive within a short window and hands them to one batch handler.
+
+    The handler takes the list of submitted items and returns one result per item, in order.
+    Each batch runs as its own task, so a slow batch never holds up the next window.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[List[Any]]], max_batch: int, max_wait: float):
+        self._handler = handler
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result from the next batch"""
+        if self._collector is None or self._collector.done():
+            # Started lazily so it belongs to the running event loop
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Only wait for company when the queue cannot already fill the batch
+            if self._queue.qsize() < self._max_batch - 1:
+                await asyncio.sleep(self._max_wait)
+            while len(batch) < self._max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _dispatch(self, batch: list):
+        futures = [future for _, future in batch]
+        try:
+            results = await self._handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,20 @@
+import pyodbc
+
+# Looks up the user's cart and creates it if missing, in a single round trip.
+# NOCOUNT is switched back off so rowcount keeps working on the pooled connection.
+GET_OR_CREATE_CART_SQL = """
+    SET NOCOUNT ON;
+    DECLARE @CartID INT;
+    SELECT TOP (1) @CartID = CartID FROM Cart WITH (UPDLOCK, HOLDLOCK) WHERE UserID = ? ORDER BY CartID;
+    IF @CartID IS NULL
+    BEGIN
+        INSERT INTO Cart (UserID) VALUES (?);
+        SET @CartID = SCOPE_IDENTITY();
+    END;
+    SET NOCOUNT OFF;
+    SELECT @CartID;
+"""
+
+def get_or_create_cart_id(cursor: pyodbc.Cursor, user_id: int) -> int:
+    """Return the user's cart ID, creating the cart if it doesn't exist"""
+    return cursor.execute(GET_OR_CREATE_CART_SQL, user_id, user_id).fetchval()
@@ -1,15 +1,149 @@
-import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
-from dataclasses import dataclass, field
-from app.database import get_connection
-from app.config import OPENAI_API_KEY, OPENAI_MODEL
-from openai import OpenAI
+from dataclasses import asdict, dataclass, field
+from app.cache import TTLCache, forget_chat_context, get_chatbot_result, load_chat_context, product_detail_cache, redis_client, save_chat_context, set_chatbot_result
+from app.database import pool, prepared
+from app.streaming import json_bytes, json_loads
+from app.services.cart import get_or_create_cart_id
+from app.services.batching import AsyncMicroBatcher
+from app.services.intent_model import load_intent_classifier
+from app.config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_MAX_CONCURRENT_CALLS, INTENT_CACHE_TTL_SECONDS, ATTRIBUTE_CACHE_TTL_SECONDS
+from app.config import CHAT_CONTEXT_CACHE_SIZE, CHAT_CONTEXT_TTL_SECONDS, CHAT_CONTEXT_MAX_MESSAGES, CHAT_PROMPT_MESSAGE_MAX_CHARS, INTENT_MODEL_DIR, INTENT_MODEL_MIN_CONFIDENCE
+from app.config import INTENT_BATCH_MAX_SIZE, INTENT_BATCH_WINDOW_SECONDS, CHATBOT_DB_WORKERS
+from openai import AsyncOpenAI
+import httpx
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Keyword tables and patterns for the rule-based fallbacks, built once at import
+CART_WORDS = ('cart', 'basket')
+ADD_WORDS = ('add', 'put')
+REMOVE_WORDS = ('remove', 'delete')
+PRODUCT_WORDS = ('product', 'item')
+SEARCH_WORDS = ('find', 'search', 'looking', 'want', 'need', 'show')
+ORDINALS = {
+    'first': 0, '1st': 0,
+    'second': 1, '2nd': 1,
+    'third': 2, '3rd': 2,
+    'fourth': 3, '4th': 3,
+    'fifth': 4, '5th': 4
+}
+DIGITS_PATTERN = re.compile(r'\d+')
+# A number counts as a price only with a bound word, a currency sign or a "k"/currency suffix,
+# so product IDs and quantities ("product 12", "add 2 shirts") are left alone
+PRICE_MAX_WORDS = ('under', 'below', 'less than', 'up to', 'max')
+PRICE_MIN_WORDS = ('over', 'above', 'more than', 'at least', 'min')
+PRICE_PATTERN = re.compile(
+    r'(?:\b(' + '|'.join(PRICE_MAX_WORDS + PRICE_MIN_WORDS + ('around', 'about')) + r')\s+)?'
+    r'([$đ₫]\s?)?(\d{1,3}(?:[.,]\d{3})+|\d+)(?:\s?(k|\$|đ|₫|vnd|usd|dollars?)(?!\w))?'
+)
+PRODUCT_ID_PATTERN = re.compile(r'\b(\d+)\b')
+
+# Replies to bare greetings, thanks and goodbyes, which need no model call
+GREETING_REPLY = "Hello! I'm here to help you find products and manage your shopping. What can I do for you?"
+THANKS_REPLY = "You're welcome! Let me know if there's anything else you'd like to find."
+GOODBYE_REPLY = "Goodbye! Come back anytime you need help with your shopping."
+CANNED_REPLIES = {
+    **dict.fromkeys(("hi", "hello", "hey", "hi there", "hello there", "hey there", "good morning", "good afternoon", "good evening"), GREETING_REPLY),
+    **dict.fromkeys(("thanks", "thank you", "thanks a lot", "thank you so much", "thx", "ty"), THANKS_REPLY),
+    **dict.fromkeys(("bye", "goodbye", "bye bye", "see you", "see ya"), GOODBYE_REPLY)
+}
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')
+
+def canned_reply(message: str) -> Optional[str]:
+    """Return the fixed reply for a bare greeting, thanks or goodbye, ignoring case and punctuation"""
+    return CANNED_REPLIES.get(" ".join(NON_WORD_PATTERN.sub(" ", message.lower()).split()))
+
+# Shared by every friendly-chat request so the prompt prefix is identical across calls
+FRIENDLY_CHAT_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "You are a helpful e-commerce shopping assistant. "
+        "Keep responses concise and friendly. If the user asks about non-shopping topics, "
+        "gently redirect them to shopping-related topics. You can make small talk but "
+        "always try to be helpful with their shopping needs."
+    )
+}
+
+# The user's latest conversation rows, newest first
+RECENT_CONVERSATION_SQL = """
+    SELECT TOP (?) Role, Message, CreatedAt
+    FROM Conversations
+    WHERE UserID = ?
+    ORDER BY CreatedAt DESC
+"""
+
+PRODUCT_DETAIL_SQL = """
+    SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID
+    FROM Products
+    WHERE ProductID = ?
+"""
+
+VIEW_CART_COLUMNS = ("CartItemID", "ProductID", "Name", "Price", "Quantity", "Color", "Style", "Total")
+
+# The user's cart items with product details, looked up by user in one round trip;
+# the same single cart (lowest CartID) that get_or_create_cart_id and checkout use
+VIEW_CART_SQL = """
+    SELECT ci.CartItemID, ci.ProductID, p.Name, p.Price, ci.Quantity,
+           p.Color, p.Style, (p.Price * ci.Quantity) as Total
+    FROM CartItems ci
+    JOIN Products p ON ci.ProductID = p.ProductID
+    WHERE ci.CartID = (SELECT TOP (1) CartID FROM Cart WHERE UserID = ? ORDER BY CartID)
+"""
+
+# Deletes the given products from the user's cart and reports whether the cart exists,
+# how many items went and how many remain; the IDs travel as one dbo.IntIdList TVP
+REMOVE_FROM_CART_SQL = "{CALL dbo.sp_RemoveCartItems(?, ?)}"
+
+# Saves the user message and bot response in one statement; OUTPUT returns both new IDs
+SAVE_CONVERSATION_SQL = """
+    INSERT INTO Conversations (UserID, Role, Message, CreatedAt, Intent, SessionID, Metadata)
+    OUTPUT INSERTED.ConversationID
+    VALUES (?, 1, ?, GETDATE(), ?, ?, ?),
+           (?, 2, ?, GETDATE(), ?, ?, ?)
+"""
+
+# For databases created before the Intent/SessionID/Metadata columns existed
+SAVE_CONVERSATION_BASIC_SQL = """
+    INSERT INTO Conversations (UserID, Role, Message, CreatedAt)
+    OUTPUT INSERTED.ConversationID
+    VALUES (?, 1, ?, GETDATE()),
+           (?, 2, ?, GETDATE())
+"""
+
+PRODUCT_SEARCH_COLUMNS = ("ProductID", "Name", "Description", "Price", "Stock", "Color", "Style", "CategoryID")
+
+@lru_cache(maxsize=32)
+def _product_search_sql(conditions: Tuple[str, ...]) -> str:
+    # Conditions are always added in the same order, so each combination of filled slots maps to one
+    # SQL text that stays prepared on the pooled connection and reuses one cached plan.
+    # Display defaults are applied by the server so rows map straight onto PRODUCT_SEARCH_COLUMNS.
+    return f"""
+        SELECT TOP 10 ProductID, COALESCE(NULLIF(Name, ''), 'Product'), ISNULL(Description, ''), ISNULL(Price, 0), ISNULL(Stock, 0),
+               COALESCE(NULLIF(Color, ''), 'N/A'), COALESCE(NULLIF(Style, ''), 'N/A'), COALESCE(NULLIF(CategoryID, 0), 1)
+        FROM Products
+        WHERE {" AND ".join(conditions)}
+        ORDER BY ProductID DESC
+    """
+
+# Adds one of each in-stock product to the cart, or bumps its quantity, and returns the products added
+ADD_PRODUCTS_TO_CART_SQL = """
+    MERGE CartItems WITH (HOLDLOCK) AS t
+    USING (SELECT ProductID, Name, Price FROM Products WHERE Stock > 0 AND ProductID IN ({placeholders})) AS s
+    ON t.CartID = ? AND t.ProductID = s.ProductID
+    WHEN MATCHED THEN
+        UPDATE SET t.Quantity = t.Quantity + 1
+    WHEN NOT MATCHED THEN
+        INSERT (CartID, ProductID, Quantity) VALUES (?, s.ProductID, 1)
+    OUTPUT s.ProductID, s.Name, s.Price;
+"""
+
 @dataclass
 class SlotFillingState:
     """Tracks the state of slot filling for product search"""
@@ -46,13 +180,32 @@ class ImprovedChatbotService:
     
     def __init__(self):
         try:
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
+            # One pooled HTTP client so keep-alive connections are reused across OpenAI calls
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+                )
+            )
+            self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=self.http_client)
         except Exception as e:
-            logger.error(f"Failed to initialize OpenAI client: {e}")
+            logger.exception("Failed to initialize OpenAI client: %s", e)
             self.client = None
         
-        # Store conversation contexts per user
-        self.user_contexts: Dict[int, ConversationContext] = {}
+        # Optional local classifier that answers confident intents without an OpenAI round trip
+        self.intent_model = load_intent_classifier(INTENT_MODEL_DIR)
+        
+        # Caps concurrent OpenAI calls, now that one chat turn can issue several at once
+        self._openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENT_CALLS)
+        
+        # Intent classifications from concurrent chats share one OpenAI call
+        self._intent_batcher = AsyncMicroBatcher(self._classify_intents, INTENT_BATCH_MAX_SIZE, INTENT_BATCH_WINDOW_SECONDS)
+        
+        # Blocking pyodbc work runs here so SQL waits overlap with OpenAI waits on the event loop
+        self._db_executor = ThreadPoolExecutor(max_workers=CHATBOT_DB_WORKERS, thread_name_prefix="chatbot-db")
+        
+        # Conversation contexts per user; kept in Redis instead when it is configured so any worker can continue a chat
+        self.user_contexts = TTLCache(CHAT_CONTEXT_CACHE_SIZE, CHAT_CONTEXT_TTL_SECONDS)
         
         # Intent definitions for OpenAI
         self.intent_definitions = {
@@ -64,6 +217,34 @@ class ImprovedChatbotService:
             "friendly_chat": "User is making general conversation or small talk"
         }
         
+        # JSON schema for intent answers: one {intent, confidence} per classified message
+        self._intent_response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "intent_classifications",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "results": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "intent": {"type": "string", "enum": list(self.intent_definitions)},
+                                    "confidence": {"type": "number"}
+                                },
+                                "required": ["intent", "confidence"],
+                                "additionalProperties": False
+                            }
+                        }
+                    },
+                    "required": ["results"],
+                    "additionalProperties": False
+                }
+            }
+        }
+        
         # Category mappings
         self.category_mapping = {
             1: ['shirt', 'top', 'blouse', 'tee', 't-shirt', 'polo', 'tank'],
@@ -74,54 +255,94 @@ class ImprovedChatbotService:
             6: ['bag', 'purse', 'handbag', 'backpack', 'watch', 'jewelry', 'accessories']
         }
         
+        # Category keyword -> CategoryID, so a slot value resolves with one lookup
+        self._keyword_to_category_id = {keyword.lower(): category_id for category_id, keywords in self.category_mapping.items() for keyword in keywords}
+        
         # Style options
         self.style_options = ['casual', 'formal', 'smart casual', 'trendy', 'classic', 'elegant', 'sport', 'basic']
         
         # Color options
         self.color_options = ['black', 'white', 'blue', 'red', 'green', 'gray', 'brown', 'pink', 'yellow', 'purple']
+        
+        # Every known keyword in one compiled pattern, so a message is scanned once; longest first so "smart casual" beats "casual"
+        self._attribute_slots = {keyword: "category" for keywords in self.category_mapping.values() for keyword in keywords}
+        self._attribute_slots.update({style: "style" for style in self.style_options})
+        self._attribute_slots.update({color: "color" for color in self.color_options})
+        self._attribute_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(keyword) for keyword in sorted(self._attribute_slots, key=len, reverse=True)) + ")"
+        )
 
-    def chat(self, user_id: int, message: str) -> Dict[str, Any]:
+    async def chat(self, user_id: int, message: str, on_delta: Optional[Callable[[str], Awaitable[None]]] = None, wait_for_save: bool = True) -> Dict[str, Any]:
         """
         Main chat method with conversation memory and context awareness
+        
+        OpenAI calls are awaited on the event loop; database work runs in worker threads.
+        When on_delta is given, a generated search or friendly-chat reply is also passed to it piece by piece as it streams in.
+        With wait_for_save=False the turn is saved after returning, and the result has no conversation_id.
         """
         try:
             # Get or create user context
-            context = self._get_or_create_context(user_id)
+            context = await asyncio.to_thread(self._get_or_create_context, user_id)
+            products_shown = context.last_products_shown
             
             # Add user message to context
             context.messages.append({"role": "user", "content": message})
             
-            # Load recent conversation history from database
-            self._load_conversation_history(context)
-            
-            # Classify intent with conversation context
-            intent_result = self._classify_intent_with_context(message, context)
-            
-            # Process based on intent
-            if intent_result["intent"] == "search_products":
-                result = self._handle_product_search_with_slots(message, context)
-            elif intent_result["intent"] == "add_to_cart":
-                result = self._handle_add_to_cart(message, context)
-            elif intent_result["intent"] == "view_cart":
-                result = self._handle_view_cart(context)
-            elif intent_result["intent"] == "product_view":
-                result = self._handle_product_view(message, context)
-            elif intent_result["intent"] == "remove_from_cart":
-                result = self._handle_remove_from_cart(message, context)
+            # Load recent conversation history from database, only for a cold context holding just this message;
+            # a warm one (in memory or Redis) already carries it
+            if len(context.messages) == 1:
+                await self._run_db(self._load_conversation_history, context)
+            
+            canned = canned_reply(message)
+            if canned is not None:
+                # Bare greetings, thanks and goodbyes skip classification, extraction and the model entirely
+                intent_result = {"intent": "friendly_chat", "confidence": 1.0, "entities": {}}
+                result = {
+                    "response": canned,
+                    "intent": "friendly_chat",
+                    "actions_performed": ["friendly_chat"],
+                    "products": []
+                }
             else:
-                result = self._handle_friendly_chat(message, context)
+                intent_result = await self._classify_intent_with_context(message, context)
+            
+                # Process based on intent; search attributes are extracted only for a product search,
+                # so other intents never pay for the OpenAI extraction fallback
+                if intent_result["intent"] == "search_products":
+                    result = await self._handle_product_search_with_slots(message, context, on_delta=on_delta)
+                elif intent_result["intent"] == "add_to_cart":
+                    result = await self._run_db(self._handle_add_to_cart, message, context)
+                elif intent_result["intent"] == "view_cart":
+                    result = await self._run_db(self._handle_view_cart, context)
+                elif intent_result["intent"] == "product_view":
+                    result = await self._run_db(self._handle_product_view, message, context)
+                elif intent_result["intent"] == "remove_from_cart":
+                    result = await self._run_db(self._handle_remove_from_cart, message, context)
+                else:
+                    result = await self._handle_friendly_chat(message, context, on_delta)
             
             # Update context
             context.current_intent = intent_result["intent"]
             context.last_action = result.get("actions_performed", ["friendly_chat"])[0]
             context.messages.append({"role": "assistant", "content": result["response"]})
+            await asyncio.to_thread(self._store_context, context, context.last_products_shown is not products_shown)
             
-            # Save conversation with metadata
+            # Save conversation with metadata; a copy of the slot state, since a background save may run after the next turn starts
             metadata = {
-                "slot_state": context.slot_state.__dict__ if hasattr(context.slot_state, '__dict__') else None,
+                "slot_state": asdict(context.slot_state),
                 "confidence": intent_result.get("confidence", 0)
             }
-            conversation_id = self._save_conversation(
+            if not wait_for_save:
+                # _save_conversation logs and swallows its own errors, so nothing needs to await this
+                self._db_executor.submit(
+                    self._save_conversation, user_id, message, result["response"],
+                    intent=intent_result["intent"], metadata=metadata
+                )
+                result["conversation_id"] = None
+                return result
+            
+            conversation_id = await self._run_db(
+                self._save_conversation,
                 user_id, 
                 message, 
                 result["response"], 
@@ -133,7 +354,7 @@ class ImprovedChatbotService:
             return result
             
         except Exception as e:
-            logger.error(f"Chat error: {e}")
+            logger.exception("Chat error: %s", e)
             return {
                 "response": "I apologize, but I encountered an error. Please try again.",
                 "products": [],
@@ -142,133 +363,184 @@ class ImprovedChatbotService:
                 "intent": "error"
             }
 
+    async def aclose(self):
+        """Finish background conversation saves and close the OpenAI HTTP client"""
+        await asyncio.to_thread(self._db_executor.shutdown, wait=True)
+        http_client = getattr(self, "http_client", None)
+        if http_client is not None:
+            await http_client.aclose()
+
+    async def _run_db(self, func, *args, **kwargs):
+        """Run a blocking database helper on the chatbot's DB executor"""
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, partial(func, *args, **kwargs))
+
     def _get_or_create_context(self, user_id: int) -> ConversationContext:
         """Get existing context or create new one"""
-        if user_id not in self.user_contexts:
-            self.user_contexts[user_id] = ConversationContext(user_id=user_id)
-        return self.user_contexts[user_id]
+        if redis_client is not None:
+            stored = load_chat_context(user_id)
+            if stored is None:
+                return ConversationContext(user_id=user_id)
+            state, products = stored
+            return ConversationContext(
+                user_id=user_id,
+                messages=state["messages"],
+                current_intent=state["current_intent"],
+                slot_state=SlotFillingState(**state["slot_state"]),
+                last_products_shown=products,
+                last_action=state["last_action"]
+            )
+        
+        context = self.user_contexts.get(user_id)
+        if context is None:
+            context = ConversationContext(user_id=user_id)
+            self.user_contexts.set(user_id, context)
+        return context
+
+    def _store_context(self, context: ConversationContext, products_changed: bool):
+        """Save the context after a turn, renewing its expiry"""
+        context.messages = context.messages[-CHAT_CONTEXT_MAX_MESSAGES:]
+        if redis_client is None:
+            self.user_contexts.set(context.user_id, context)
+            return
+        
+        # The product list is only rewritten after a new search
+        state = asdict(context)
+        products = state.pop("last_products_shown")
+        save_chat_context(context.user_id, state, products if products_changed else None, CHAT_CONTEXT_TTL_SECONDS)
 
     def _load_conversation_history(self, context: ConversationContext, limit: int = 5):
         """Load recent conversation history from database into context"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Get recent messages
-            cursor.execute("""
-                SELECT TOP (?) Role, Message, CreatedAt
-                FROM Conversations 
-                WHERE UserID = ? 
-                ORDER BY CreatedAt DESC
-            """, (limit * 2, context.user_id))  # *2 to get both user and bot messages
-            
-            results = cursor.fetchall()
+            with pool.connection() as conn:
+                # Get recent messages, *2 to get both user and bot messages
+                results = prepared(conn, RECENT_CONVERSATION_SQL).fetchall(limit * 2, context.user_id)
             
-            # Convert to message format and add to context if not already there
-            history_messages = []
-            for row in reversed(results):
-                role = "user" if row[0] == 1 else "assistant"
-                history_messages.append({"role": role, "content": row[1]})
+                # Convert to message format and add to context if not already there
+                history_messages = []
+                for row in reversed(results):
+                    role = "user" if row[0] == 1 else "assistant"
+                    history_messages.append({"role": role, "content": row[1]})
             
-            # Prepend history to current messages (avoiding duplicates)
-            if len(context.messages) <= 2:  # Only current exchange
-                context.messages = history_messages + context.messages
-            
-            conn.close()
+                # Prepend history to current messages (avoiding duplicates)
+                if len(context.messages) <= 2:  # Only current exchange
+                    context.messages = history_messages + context.messages
             
         except Exception as e:
-            logger.error(f"Error loading conversation history: {e}")
+            logger.exception("Error loading conversation history: %s", e)
 
-    def _classify_intent_with_context(self, message: str, context: ConversationContext) -> Dict[str, Any]:
-        """Classify intent using OpenAI with conversation context"""
+    async def _classify_intent_with_context(self, message: str, context: ConversationContext) -> Dict[str, Any]:
+        """Classify intent with the local model, or OpenAI with conversation context when the model is unsure"""
+        if self.intent_model is not None:
+            intent, confidence = await asyncio.to_thread(self.intent_model.classify, message)
+            if confidence >= INTENT_MODEL_MIN_CONFIDENCE:
+                return {"intent": intent, "confidence": confidence, "entities": {}}
+        
         if not self.client:
             return self._fallback_intent_classification(message)
         
+        # The same message right after the same intent classifies the same way
+        cache_text = f"{context.current_intent or ''}|{message}"
+        cached = await asyncio.to_thread(get_chatbot_result, "intent", cache_text)
+        if cached is not None:
+            return cached
+        
         try:
-            # Build context-aware prompt
-            intent_list = ", ".join(self.intent_definitions.keys())
-            
             # Include conversation history in the prompt
-            conversation_context = "\n".join([
-                f"{msg['role']}: {msg['content']}" 
-                for msg in context.messages[-6:]  # Last 3 exchanges
-            ])
+            conversation_context = self._compact_history(context.messages[-6:])  # Last 3 exchanges
             
-            prompt = f"""You are an intent classifier for an e-commerce chatbot. 
+            result = await self._intent_batcher.submit((message, conversation_context))
+            await asyncio.to_thread(set_chatbot_result, "intent", cache_text, result, INTENT_CACHE_TTL_SECONDS)
+            return result
             
-Based on the conversation history and the current user message, classify the intent.
-
-Available intents:
-{chr(10).join([f"- {intent}: {desc}" for intent, desc in self.intent_definitions.items()])}
+        except Exception as e:
+            logger.exception("OpenAI intent classification error: %s", e)
+            return self._fallback_intent_classification(message)
 
-Conversation history:
-{conversation_context}
+    def _compact_history(self, messages: List[Dict[str, str]]) -> str:
+        """Render history for a prompt: the last two exchanges clipped, anything older as a one-line recap of the user's requests"""
+        older, latest = messages[:-4], messages[-4:]
+        lines = []
+        earlier_requests = [msg["content"][:80] for msg in older if msg["role"] == "user"]
+        if earlier_requests:
+            lines.append(f"summary: earlier the user asked about {'; '.join(earlier_requests)}")
+        lines.extend(f"{msg['role']}: {msg['content'][:CHAT_PROMPT_MESSAGE_MAX_CHARS]}" for msg in latest)
+        return "\n".join(lines)
 
-Current user message: {message}
+    async def _classify_intents(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Classify a batch of (message, conversation history) pairs with one OpenAI call"""
+        conversations = "\n\n".join([
+            f"Conversation {number}:\n{conversation_context}\nCurrent message: {message}"
+            for number, (message, conversation_context) in enumerate(items, 1)
+        ])
+        
+        prompt = f"""Classify the current user message of each conversation, in order.
 
-Respond with a JSON object containing:
-- "intent": one of [{intent_list}]
-- "confidence": a number between 0 and 1
-- "entities": extracted entities like product_ids, colors, styles, categories, etc.
+Intents:
+{chr(10).join([f"- {intent}: {desc}" for intent, desc in self.intent_definitions.items()])}
 
-Examples:
-User: "I want to buy a black shirt"
-Response: {{"intent": "search_products", "confidence": 0.9, "entities": {{"color": "black", "category": "shirt"}}}}
+{conversations}"""
+        
+        # Structured output guarantees schema-valid JSON, and a two-field answer keeps decoding short
+        response = await self._complete(
+            messages=[
+                {"role": "system", "content": "You are a precise intent classifier for an e-commerce chatbot."},
+                {"role": "user", "content": prompt}
+            ],
+            response_format=self._intent_response_format,
+            temperature=0.3,  # Lower temperature for more consistent classification
+            max_tokens=40 + 30 * len(items)
+        )
+        
+        results = json_loads(response.choices[0].message.content)["results"]
+        return [{"intent": result["intent"], "confidence": result["confidence"], "entities": {}} for result in results]
 
-User: "add product 123 to cart"
-Response: {{"intent": "add_to_cart", "confidence": 0.95, "entities": {{"product_ids": [123]}}}}
+    async def _complete(self, **kwargs):
+        """Create a chat completion, waiting for a free slot under the concurrency cap"""
+        async with self._openai_slots:
+            return await self.client.chat.completions.create(model=OPENAI_MODEL, **kwargs)
 
-User: "tell me more about product 456"
-Response: {{"intent": "product_view", "confidence": 0.9, "entities": {{"product_ids": [456]}}}}
-"""
-            
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a precise intent classifier. Always respond with valid JSON only, no additional text."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,  # Lower temperature for more consistent classification
-                max_tokens=2000
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            # Try to extract JSON if wrapped in markdown code blocks
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(response_text)
-            return result
-            
-        except Exception as e:
-            logger.error(f"OpenAI intent classification error: {e}")
-            return self._fallback_intent_classification(message)
+    async def _complete_text(self, on_delta: Optional[Callable[[str], Awaitable[None]]] = None, **kwargs) -> str:
+        """Return a completion's text, streaming it to on_delta piece by piece if given"""
+        if on_delta is None:
+            response = await self._complete(**kwargs)
+            return response.choices[0].message.content.strip()
+        
+        # Hold the concurrency slot until the stream is drained, not just until it opens
+        parts = []
+        async with self._openai_slots:
+            stream = await self.client.chat.completions.create(model=OPENAI_MODEL, stream=True, **kwargs)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    await on_delta(delta)
+        
+        return "".join(parts).strip()
 
     def _fallback_intent_classification(self, message: str) -> Dict[str, Any]:
         """Fallback rule-based intent classification"""
         message_lower = message.lower()
         
         # Simple pattern matching
-        if any(word in message_lower for word in ['cart', 'basket']):
-            if any(word in message_lower for word in ['add', 'put']):
+        if any(word in message_lower for word in CART_WORDS):
+            if any(word in message_lower for word in ADD_WORDS):
                 return {"intent": "add_to_cart", "confidence": 0.8, "entities": {}}
-            elif any(word in message_lower for word in ['remove', 'delete']):
+            elif any(word in message_lower for word in REMOVE_WORDS):
                 return {"intent": "remove_from_cart", "confidence": 0.8, "entities": {}}
             else:
                 return {"intent": "view_cart", "confidence": 0.8, "entities": {}}
-        elif any(word in message_lower for word in ['product', 'item']) and re.search(r'\d+', message):
+        elif any(word in message_lower for word in PRODUCT_WORDS) and DIGITS_PATTERN.search(message):
             return {"intent": "product_view", "confidence": 0.8, "entities": {}}
-        elif any(word in message_lower for word in ['find', 'search', 'looking', 'want', 'need', 'show']):
+        elif any(word in message_lower for word in SEARCH_WORDS):
             return {"intent": "search_products", "confidence": 0.8, "entities": {}}
         else:
             return {"intent": "friendly_chat", "confidence": 0.7, "entities": {}}
 
-    def _handle_product_search_with_slots(self, message: str, context: ConversationContext) -> Dict[str, Any]:
+    async def _handle_product_search_with_slots(self, message: str, context: ConversationContext, entities: Optional[Dict[str, Any]] = None, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
         """Handle product search with slot filling"""
-        # Extract entities from message
-        entities = self._extract_product_attributes(message, context)
+        # Extract entities from message unless the caller already did
+        if entities is None:
+            entities = await self._extract_product_attributes(message, context)
         
         # Update slot state
         slot_state = context.slot_state
@@ -285,7 +557,7 @@ Response: {{"intent": "product_view", "confidence": 0.9, "entities": {{"product_
         if not slot_state.check_completeness():
             # Ask for missing information
             missing_slots = self._get_missing_slots(slot_state)
-            response = self._generate_slot_filling_question(missing_slots, context)
+            response = await self._generate_slot_filling_question(missing_slots, context)
             # Determine which slot is missing (pick the first for simplicity)
             missing_slot = missing_slots[0] if missing_slots else None
             return {
@@ -302,7 +574,7 @@ Response: {{"intent": "product_view", "confidence": 0.9, "entities": {{"product_
             }
         
         # We have enough information, perform search
-        search_results = self._search_products_with_slots(slot_state)
+        search_results = await self._run_db(self._search_products_with_slots, slot_state)
         
         # Clear slot state after search
         context.slot_state = SlotFillingState()
@@ -312,7 +584,7 @@ Response: {{"intent": "product_view", "confidence": 0.9, "entities": {{"product_
         
         # Generate response
         if search_results:
-            response = self._format_product_results(search_results, context)
+            response = await self._format_product_results(search_results, context, on_delta)
         else:
             response = "I couldn't find any products matching your criteria. Would you like to try different specifications?"
         
@@ -323,10 +595,15 @@ Response: {{"intent": "product_view", "confidence": 0.9, "entities": {{"product_
             "products": search_results
         }
 
-    def _extract_product_attributes(self, message: str, context: ConversationContext) -> Dict[str, Any]:
-        """Extract product attributes using OpenAI"""
-        if not self.client:
-            return self._fallback_extract_attributes(message)
+    async def _extract_product_attributes(self, message: str, context: ConversationContext) -> Dict[str, Any]:
+        """Extract product attributes by keyword scan, asking OpenAI only when no keyword matches"""
+        attributes = self._scan_product_attributes(message)
+        if attributes or not self.client:
+            return attributes
+        
+        cached = await asyncio.to_thread(get_chatbot_result, "attributes", message)
+        if cached is not None:
+            return cached
         
         try:
             prompt = f"""Extract product attributes from the user message.
@@ -342,8 +619,7 @@ Return a JSON object with any found attributes:
 
 Only include attributes that are explicitly mentioned."""
 
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
+            response = await self._complete(
                 messages=[
                     {"role": "system", "content": "You are a product attribute extractor. Return only valid JSON."},
                     {"role": "user", "content": prompt}
@@ -352,43 +628,38 @@ Only include attributes that are explicitly mentioned."""
                 max_tokens=150
             )
             
-            return json.loads(response.choices[0].message.content.strip())
+            attributes = json_loads(response.choices[0].message.content)
+            await asyncio.to_thread(set_chatbot_result, "attributes", message, attributes, ATTRIBUTE_CACHE_TTL_SECONDS)
+            return attributes
             
         except Exception as e:
-            logger.error(f"Attribute extraction error: {e}")
-            return self._fallback_extract_attributes(message)
+            logger.exception("Attribute extraction error: %s", e)
+            return attributes
 
-    def _fallback_extract_attributes(self, message: str) -> Dict[str, Any]:
-        """Fallback attribute extraction using patterns"""
+    def _scan_product_attributes(self, message: str) -> Dict[str, Any]:
+        """Extract known category, style and color keywords and a price from the message"""
         attributes = {}
         message_lower = message.lower()
         
-        # Extract category
-        for cat_id, keywords in self.category_mapping.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    attributes["category"] = keyword
-                    break
-        
-        # Extract color
-        for color in self.color_options:
-            if color in message_lower:
-                attributes["color"] = color
-                break
+        # The first keyword found for each slot wins
+        for match in self._attribute_pattern.finditer(message_lower):
+            attributes.setdefault(self._attribute_slots[match.group(1)], match.group(1))
         
-        # Extract style  
-        for style in self.style_options:
-            if style in message_lower:
-                attributes["style"] = style
-                break
-        
-        # Extract price
-        price_match = re.search(r'(\d+)k?', message_lower)
-        if price_match:
-            price = int(price_match.group(1))
-            if 'k' in message_lower:
+        # Extract price: "under"/"over" set one bound, otherwise a band around the amount
+        for price_match in PRICE_PATTERN.finditer(message_lower):
+            bound, currency, amount, suffix = price_match.groups()
+            if not (bound or currency or suffix):
+                continue
+            price = int(amount.replace(",", "").replace(".", ""))
+            if suffix == "k":
                 price *= 1000
-            attributes["price_range"] = {"min": price * 0.8, "max": price * 1.2}
+            if bound in PRICE_MAX_WORDS:
+                attributes["price_range"] = {"min": None, "max": price}
+            elif bound in PRICE_MIN_WORDS:
+                attributes["price_range"] = {"min": price, "max": None}
+            else:
+                attributes["price_range"] = {"min": price * 0.8, "max": price * 1.2}
+            break
         
         return attributes
 
@@ -401,7 +672,7 @@ Only include attributes that are explicitly mentioned."""
             missing.extend(["style", "color"])
         return missing
 
-    def _generate_slot_filling_question(self, missing_slots: List[str], context: ConversationContext) -> str:
+    async def _generate_slot_filling_question(self, missing_slots: List[str], context: ConversationContext) -> str:
         """Generate a natural question to fill missing slots"""
         if not self.client:
             return self._fallback_slot_question(missing_slots)
@@ -426,8 +697,7 @@ Examples:
 
 Keep it brief and natural."""
 
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
+            response = await self._complete(
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
                 max_tokens=100
@@ -436,7 +706,7 @@ Keep it brief and natural."""
             return response.choices[0].message.content.strip()
             
         except Exception as e:
-            logger.error(f"Slot question generation error: {e}")
+            logger.exception("Slot question generation error: %s", e)
             return self._fallback_slot_question(missing_slots)
 
     def _fallback_slot_question(self, missing_slots: List[str]) -> str:
@@ -455,85 +725,54 @@ Keep it brief and natural."""
     def _search_products_with_slots(self, slot_state: SlotFillingState) -> List[Dict[str, Any]]:
         """Search products based on filled slots"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            where_conditions = ["Stock > 0"]
-            params = []
-            
-            # Category condition
-            if slot_state.category:
-                category_id = None
-                for cat_id, keywords in self.category_mapping.items():
-                    if slot_state.category.lower() in [k.lower() for k in keywords]:
-                        category_id = cat_id
-                        break
-                if category_id:
-                    where_conditions.append("CategoryID = ?")
-                    params.append(category_id)
-            
-            # Color condition
-            if slot_state.color:
-                where_conditions.append("Color LIKE ?")
-                params.append(f"%{slot_state.color}%")
-            
-            # Style condition
-            if slot_state.style:
-                where_conditions.append("Style LIKE ?")
-                params.append(f"%{slot_state.style}%")
-            
-            # Price condition
-            if slot_state.price_range:
-                if slot_state.price_range.get("min"):
-                    where_conditions.append("Price >= ?")
-                    params.append(slot_state.price_range["min"])
-                if slot_state.price_range.get("max"):
-                    where_conditions.append("Price <= ?")
-                    params.append(slot_state.price_range["max"])
-            
-            where_clause = " AND ".join(where_conditions)
-            
-            query = f"""
-            SELECT TOP 10 ProductID, Name, Description, Price, Stock, Color, Style, CategoryID
-            FROM Products
-            WHERE {where_clause}
-            ORDER BY ProductID DESC
-            """
+            with pool.connection() as conn:
+                where_conditions = ["Stock > 0"]
+                params = []
+            
+                # Category condition
+                if slot_state.category:
+                    category_id = self._keyword_to_category_id.get(slot_state.category.lower())
+                    if category_id:
+                        where_conditions.append("CategoryID = ?")
+                        params.append(category_id)
+            
+                # Color condition
+                if slot_state.color:
+                    where_conditions.append("Color LIKE ?")
+                    params.append(f"%{slot_state.color}%")
+            
+                # Style condition
+                if slot_state.style:
+                    where_conditions.append("Style LIKE ?")
+                    params.append(f"%{slot_state.style}%")
+            
+                # Price condition
+                if slot_state.price_range:
+                    if slot_state.price_range.get("min"):
+                        where_conditions.append("Price >= ?")
+                        params.append(slot_state.price_range["min"])
+                    if slot_state.price_range.get("max"):
+                        where_conditions.append("Price <= ?")
+                        params.append(slot_state.price_range["max"])
+            
+                results = prepared(conn, _product_search_sql(tuple(where_conditions))).fetchall(*params)
+            
+                products = [dict(zip(PRODUCT_SEARCH_COLUMNS, row)) for row in results]
             
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            
-            products = []
-            for row in results:
-                products.append({
-                    "ProductID": row[0],
-                    "Name": row[1] or "Product",
-                    "Description": row[2] or "",
-                    "Price": float(row[3]) if row[3] else 0.0,
-                    "Stock": row[4] or 0,
-                    "Color": row[5] or "N/A",
-                    "Style": row[6] or "N/A",
-                    "CategoryID": row[7] or 1
-                })
-            
-            conn.close()
             return products
             
         except Exception as e:
-            logger.error(f"Product search error: {e}")
+            logger.exception("Product search error: %s", e)
             return []
 
-    def _format_product_results(self, products: List[Dict], context: ConversationContext) -> str:
-        """Format product results with context awareness"""
+    async def _format_product_results(self, products: List[Dict], context: ConversationContext, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """Format product results with context awareness, streaming the text to on_delta if given"""
         if not self.client:
             return self._simple_format_products(products)
         
         try:
             # Include conversation context
-            recent_context = "\n".join([
-                f"{msg['role']}: {msg['content']}" 
-                for msg in context.messages[-4:]
-            ])
+            recent_context = self._compact_history(context.messages[-4:])
             
             prompt = f"""Format these product search results conversationally based on the user's request.
 
@@ -541,7 +780,7 @@ Recent conversation:
 {recent_context}
 
 Products found:
-{json.dumps(products[:5], indent=2)}
+{json_bytes(products[:5]).decode()}
 
 Create a natural, helpful response that:
 1. Acknowledges what the user was looking for
@@ -551,17 +790,15 @@ Create a natural, helpful response that:
 
 Keep it concise but informative."""
 
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
+            return await self._complete_text(
+                on_delta,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
                 max_tokens=300
             )
             
-            return response.choices[0].message.content.strip()
-            
         except Exception as e:
-            logger.error(f"Product formatting error: {e}")
+            logger.exception("Product formatting error: %s", e)
             return self._simple_format_products(products)
 
     def _simple_format_products(self, products: List[Dict]) -> str:
@@ -569,14 +806,17 @@ Keep it concise but informative."""
         if not products:
             return "No products found matching your criteria."
         
-        response = f"I found {len(products)} products for you:\n\n"
+        parts = [f"I found {len(products)} products for you:\n\n"]
         for i, product in enumerate(products[:5], 1):
-            response += f"{i}. {product['Name']} (ID: {product['ProductID']})\n"
-            response += f"   💰 Price: ${product['Price']:.2f}\n"
-            response += f"   🎨 Color: {product['Color']} | Style: {product['Style']}\n"
-            response += f"   📦 Stock: {product['Stock']} available\n\n"
+            parts.append(
+                f"{i}. {product['Name']} (ID: {product['ProductID']})\n"
+                f"   💰 Price: ${product['Price']:.2f}\n"
+                f"   🎨 Color: {product['Color']} | Style: {product['Style']}\n"
+                f"   📦 Stock: {product['Stock']} available\n\n"
+            )
         
-        return response + "Would you like to see more details or add any to your cart?"
+        parts.append("Would you like to see more details or add any to your cart?")
+        return "".join(parts)
 
     def _handle_add_to_cart(self, message: str, context: ConversationContext) -> Dict[str, Any]:
         """Handle add to cart with context awareness"""
@@ -610,16 +850,8 @@ Keep it concise but informative."""
 
     def _extract_product_ids(self, message: str) -> List[int]:
         """Extract product IDs from message"""
-        ids = []
-        matches = re.findall(r'\b(\d+)\b', message)
-        for match in matches:
-            try:
-                product_id = int(match)
-                if product_id > 0 and product_id < 10000:  # Reasonable product ID range
-                    ids.append(product_id)
-            except:
-                pass
-        return ids
+        product_ids = map(int, PRODUCT_ID_PATTERN.findall(message))
+        return [product_id for product_id in product_ids if 0 < product_id < 10000]  # Reasonable product ID range
 
     def _resolve_product_reference(self, message: str, context: ConversationContext) -> Optional[int]:
         """Resolve product reference from context (e.g., 'the first one', 'the black shirt')"""
@@ -629,15 +861,7 @@ Keep it concise but informative."""
         message_lower = message.lower()
         
         # Check for ordinal references
-        ordinals = {
-            'first': 0, '1st': 0,
-            'second': 1, '2nd': 1,
-            'third': 2, '3rd': 2,
-            'fourth': 3, '4th': 3,
-            'fifth': 4, '5th': 4
-        }
-        
-        for word, index in ordinals.items():
+        for word, index in ORDINALS.items():
             if word in message_lower and index < len(context.last_products_shown):
                 return context.last_products_shown[index]['ProductID']
         
@@ -652,61 +876,19 @@ Keep it concise but informative."""
     def _add_products_to_cart(self, product_ids: List[int], user_id: int) -> str:
         """Add products to cart"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Get or create cart for user
-            cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", (user_id,))
-            cart = cursor.fetchone()
-            
-            if not cart:
-                cursor.execute("INSERT INTO Cart (UserID) VALUES (?)", (user_id,))
-                conn.commit()
-                cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", (user_id,))
-                cart = cursor.fetchone()
+            with pool.connection() as conn:
+                cursor = conn.cursor()
             
-            cart_id = cart[0]
+                # Get or create cart for user
+                cart_id = get_or_create_cart_id(cursor, user_id)
             
-            added_products = []
-            for product_id in product_ids:
-                # Check if product exists and has stock
-                cursor.execute("""
-                    SELECT Name, Price, Stock FROM Products 
-                    WHERE ProductID = ? AND Stock > 0
-                """, (product_id,))
-                
-                product = cursor.fetchone()
-                if product:
-                    # Check if item already exists in cart
-                    cursor.execute("""
-                        SELECT CartItemID, Quantity FROM CartItems 
-                        WHERE CartID = ? AND ProductID = ?
-                    """, (cart_id, product_id))
-                    
-                    existing_item = cursor.fetchone()
-                    
-                    if existing_item:
-                        # Update quantity
-                        new_quantity = existing_item[1] + 1
-                        cursor.execute("""
-                            UPDATE CartItems SET Quantity = ? 
-                            WHERE CartItemID = ?
-                        """, (new_quantity, existing_item[0]))
-                    else:
-                        # Add new item
-                        cursor.execute("""
-                            INSERT INTO CartItems (CartID, ProductID, Quantity) 
-                            VALUES (?, ?, ?)
-                        """, (cart_id, product_id, 1))
-                    
-                    added_products.append({
-                        "id": product_id,
-                        "name": product[0],
-                        "price": product[1]
-                    })
+                # Stock check, insert-or-increment and the names for the reply in one statement
+                placeholders = ", ".join("?" * len(product_ids))
+                cursor.execute(ADD_PRODUCTS_TO_CART_SQL.format(placeholders=placeholders), *product_ids, cart_id, cart_id)
+                added = {row[0]: {"id": row[0], "name": row[1], "price": row[2]} for row in cursor.fetchall()}
+                added_products = [added[product_id] for product_id in dict.fromkeys(product_ids) if product_id in added]
             
-            conn.commit()
-            conn.close()
+                conn.commit()
             
             if added_products:
                 if len(added_products) == 1:
@@ -718,40 +900,15 @@ Keep it concise but informative."""
                 return "❌ Could not add products to cart. They may be out of stock."
                 
         except Exception as e:
-            logger.error(f"Add to cart error: {e}")
+            logger.exception("Add to cart error: %s", e)
             return "Sorry, there was an error adding to your cart. Please try again."
 
     def _handle_view_cart(self, context: ConversationContext) -> Dict[str, Any]:
         """Handle view cart request"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Get user's cart
-            cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", (context.user_id,))
-            cart = cursor.fetchone()
-            
-            if not cart:
-                return {
-                    "response": "Your cart is empty. Would you like to browse some products?",
-                    "intent": "view_cart",
-                    "actions_performed": ["view_cart"],
-                    "products": []
-                }
-            
-            cart_id = cart[0]
-            
-            # Get cart items
-            cursor.execute("""
-                SELECT ci.CartItemID, ci.ProductID, p.Name, p.Price, ci.Quantity,
-                       p.Color, p.Style, (p.Price * ci.Quantity) as Total
-                FROM CartItems ci
-                JOIN Products p ON ci.ProductID = p.ProductID
-                WHERE ci.CartID = ?
-            """, (cart_id,))
-            
-            items = cursor.fetchall()
-            conn.close()
+            with pool.connection() as conn:
+                # No cart and an empty cart both come back as zero rows
+                items = prepared(conn, VIEW_CART_SQL).fetchall(context.user_id)
             
             if not items:
                 return {
@@ -761,22 +918,9 @@ Keep it concise but informative."""
                     "products": []
                 }
             
-            cart_items = []
-            total = 0
-            
-            for item in items:
-                cart_item = {
-                    "CartItemID": item[0],
-                    "ProductID": item[1],
-                    "Name": item[2],
-                    "Price": float(item[3]),
-                    "Quantity": item[4],
-                    "Color": item[5],
-                    "Style": item[6],
-                    "Total": float(item[7])
-                }
-                cart_items.append(cart_item)
-                total += item[7]
+            # Prices already arrive as float from the connection's DECIMAL converter
+            cart_items = [dict(zip(VIEW_CART_COLUMNS, item)) for item in items]
+            total = sum(item["Total"] for item in cart_items)
             
             # Format response
             response = self._format_cart_contents(cart_items, total)
@@ -789,7 +933,7 @@ Keep it concise but informative."""
             }
             
         except Exception as e:
-            logger.error(f"View cart error: {e}")
+            logger.exception("View cart error: %s", e)
             return {
                 "response": "Sorry, I couldn't retrieve your cart. Please try again.",
                 "intent": "view_cart",
@@ -799,17 +943,19 @@ Keep it concise but informative."""
 
     def _format_cart_contents(self, cart_items: List[Dict], total: float) -> str:
         """Format cart contents nicely"""
-        response = f"🛒 Your cart has {len(cart_items)} item(s):\n\n"
+        parts = [f"🛒 Your cart has {len(cart_items)} item(s):\n\n"]
         
         for i, item in enumerate(cart_items, 1):
-            response += f"{i}. {item['Name']} (ID: {item['ProductID']})\n"
-            response += f"   💰 ${item['Price']:.2f} x {item['Quantity']} = ${item['Price'] * item['Quantity']:.2f}\n"
-            response += f"   🎨 {item['Color']} | {item['Style']}\n\n"
+            parts.append(
+                f"{i}. {item['Name']} (ID: {item['ProductID']})\n"
+                f"   💰 ${item['Price']:.2f} x {item['Quantity']} = ${item['Total']:.2f}\n"
+                f"   🎨 {item['Color']} | {item['Style']}\n\n"
+            )
         
-        response += f"📊 Total: ${total:.2f}\n\n"
-        response += "Would you like to checkout or continue shopping?"
+        parts.append(f"📊 Total: ${total:.2f}\n\n")
+        parts.append("Would you like to checkout or continue shopping?")
         
-        return response
+        return "".join(parts)
 
     def _handle_product_view(self, message: str, context: ConversationContext) -> Dict[str, Any]:
         """Handle product view request"""
@@ -830,30 +976,16 @@ Keep it concise but informative."""
             }
         
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT ProductID, Name, Description, Price, Stock, Color, Style, CategoryID
-                FROM Products
-                WHERE ProductID = ?
-            """, (product_ids[0],))
-            
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                product = {
-                    "ProductID": row[0],
-                    "Name": row[1],
-                    "Description": row[2],
-                    "Price": float(row[3]),
-                    "Stock": row[4],
-                    "Color": row[5],
-                    "Style": row[6],
-                    "CategoryID": row[7]
-                }
+            product = product_detail_cache.get(product_ids[0])
+            if product is None:
+                with pool.connection() as conn:
+                    row = prepared(conn, PRODUCT_DETAIL_SQL).fetchone(product_ids[0])
                 
+                if row:
+                    product = dict(zip(PRODUCT_SEARCH_COLUMNS, row))
+                    product_detail_cache.set(product_ids[0], product)
+            
+            if product:
                 response = self._format_product_details(product)
                 
                 return {
@@ -871,7 +1003,7 @@ Keep it concise but informative."""
                 }
                 
         except Exception as e:
-            logger.error(f"Product view error: {e}")
+            logger.exception("Product view error: %s", e)
             return {
                 "response": "Sorry, I couldn't retrieve product details. Please try again.",
                 "intent": "product_view",
@@ -881,19 +1013,20 @@ Keep it concise but informative."""
 
     def _format_product_details(self, product: Dict) -> str:
         """Format detailed product information"""
-        response = f"📦 **{product['Name']}** (ID: {product['ProductID']})\n\n"
-        response += f"📝 {product['Description']}\n\n"
-        response += f"💰 Price: ${product['Price']:.2f}\n"
-        response += f"🎨 Color: {product['Color']}\n"
-        response += f"👔 Style: {product['Style']}\n"
-        response += f"📊 Stock: {product['Stock']} available\n\n"
-        
         if product['Stock'] > 0:
-            response += "Would you like to add this to your cart?"
+            closing = "Would you like to add this to your cart?"
         else:
-            response += "⚠️ This product is currently out of stock."
+            closing = "⚠️ This product is currently out of stock."
         
-        return response
+        return (
+            f"📦 **{product['Name']}** (ID: {product['ProductID']})\n\n"
+            f"📝 {product['Description']}\n\n"
+            f"💰 Price: ${product['Price']:.2f}\n"
+            f"🎨 Color: {product['Color']}\n"
+            f"👔 Style: {product['Style']}\n"
+            f"📊 Stock: {product['Stock']} available\n\n"
+            f"{closing}"
+        )
 
     def _handle_remove_from_cart(self, message: str, context: ConversationContext) -> Dict[str, Any]:
         """Handle remove from cart request"""
@@ -908,14 +1041,13 @@ Keep it concise but informative."""
             }
         
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Get user's cart
-            cursor.execute("SELECT CartID FROM Cart WHERE UserID = ?", (context.user_id,))
-            cart = cursor.fetchone()
+            # IntIdList has a primary key, so each ID goes in once
+            id_rows = [(product_id,) for product_id in dict.fromkeys(product_ids)]
+            with pool.connection() as conn:
+                has_cart, removed_count, remaining_count = prepared(conn, REMOVE_FROM_CART_SQL).fetchone(context.user_id, id_rows)
+                conn.commit()
             
-            if not cart:
+            if not has_cart:
                 return {
                     "response": "You don't have a cart yet. Try adding some products first!",
                     "intent": "remove_from_cart",
@@ -923,35 +1055,10 @@ Keep it concise but informative."""
                     "products": []
                 }
             
-            cart_id = cart[0]
-            
-            removed_items = []
-            for product_id in product_ids:
-                cursor.execute("""
-                    DELETE FROM CartItems 
-                    WHERE CartID = ? AND ProductID = ?
-                """, (cart_id, product_id))
-                
-                if cursor.rowcount > 0:
-                    removed_items.append(product_id)
-            
-            conn.commit()
-            
-            # Get updated cart
-            cursor.execute("""
-                SELECT ci.ProductID, p.Name, p.Price, ci.Quantity
-                FROM CartItems ci
-                JOIN Products p ON ci.ProductID = p.ProductID
-                WHERE ci.CartID = ?
-            """, (cart_id,))
-            
-            remaining_items = cursor.fetchall()
-            conn.close()
-            
-            if removed_items:
-                response = f"✅ Removed {len(removed_items)} item(s) from your cart.\n\n"
-                if remaining_items:
-                    response += f"You still have {len(remaining_items)} item(s) in your cart."
+            if removed_count:
+                response = f"✅ Removed {removed_count} item(s) from your cart.\n\n"
+                if remaining_count:
+                    response += f"You still have {remaining_count} item(s) in your cart."
                 else:
                     response += "Your cart is now empty."
             else:
@@ -965,7 +1072,7 @@ Keep it concise but informative."""
             }
             
         except Exception as e:
-            logger.error(f"Remove from cart error: {e}")
+            logger.exception("Remove from cart error: %s", e)
             return {
                 "response": "Sorry, there was an error removing items. Please try again.",
                 "intent": "remove_from_cart",
@@ -973,45 +1080,40 @@ Keep it concise but informative."""
                 "products": []
             }
 
-    def _handle_friendly_chat(self, message: str, context: ConversationContext) -> Dict[str, Any]:
-        """Handle general conversation with context awareness"""
+    async def _handle_friendly_chat(self, message: str, context: ConversationContext, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Any]:
+        """Handle general conversation with context awareness, streaming the reply to on_delta if given"""
         if not self.client:
             return {
-                "response": "Hello! I'm here to help you find products and manage your shopping. What can I do for you?",
+                "response": GREETING_REPLY,
                 "intent": "friendly_chat",
                 "actions_performed": ["friendly_chat"],
                 "products": []
             }
         
         try:
-            # Build context-aware conversation
-            messages = [
-                {"role": "system", "content": """You are a helpful e-commerce shopping assistant. 
-                Keep responses concise and friendly. If the user asks about non-shopping topics, 
-                gently redirect them to shopping-related topics. You can make small talk but 
-                always try to be helpful with their shopping needs."""}
-            ]
-            
-            # Add recent conversation history
-            for msg in context.messages[-6:]:
-                messages.append(msg)
+            # Fixed system message first, then recent conversation history with long replies clipped
+            messages = [FRIENDLY_CHAT_SYSTEM_MESSAGE]
+            messages.extend(
+                {"role": msg["role"], "content": msg["content"][:CHAT_PROMPT_MESSAGE_MAX_CHARS]}
+                for msg in context.messages[-6:]
+            )
             
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
+            response = await self._complete_text(
+                on_delta,
                 messages=messages,
                 temperature=0.7,
                 max_tokens=200
             )
             
             return {
-                "response": response.choices[0].message.content.strip(),
+                "response": response,
                 "intent": "friendly_chat",
                 "actions_performed": ["friendly_chat"],
                 "products": []
             }
             
         except Exception as e:
-            logger.error(f"Friendly chat error: {e}")
+            logger.exception("Friendly chat error: %s", e)
             return {
                 "response": "I'm here to help with your shopping! Feel free to ask about products or your cart.",
                 "intent": "friendly_chat",
@@ -1022,67 +1124,44 @@ Keep it concise but informative."""
     def _save_conversation(self, user_id: int, user_message: str, bot_response: str, intent: Optional[str] = None, metadata: Optional[Dict] = None) -> Optional[int]:
         """Save conversation to database with metadata"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Generate session ID if not exists - use None for now to avoid database issues
-            session_id = None
+            with pool.connection() as conn:
+                # Generate session ID if not exists - use None for now to avoid database issues
+                session_id = None
             
-            # Prepare metadata JSON
-            metadata_json = json.dumps(metadata) if metadata else None
+                # Prepare metadata JSON
+                metadata_json = json_bytes(metadata).decode() if metadata else None
             
-            # Save user message
-            cursor.execute("""
-                INSERT INTO Conversations (UserID, Role, Message, CreatedAt, Intent, SessionID, Metadata) 
-                VALUES (?, ?, ?, GETDATE(), ?, ?, ?)
-            """, (user_id, 1, user_message, intent, session_id, metadata_json))
+                # One round trip for both rows, prepared once per pooled connection
+                rows = prepared(conn, SAVE_CONVERSATION_SQL).fetchall(
+                    user_id, user_message, intent, session_id, metadata_json,
+                    user_id, bot_response, intent, session_id, metadata_json
+                )
             
-            # Save bot response
-            cursor.execute("""
-                INSERT INTO Conversations (UserID, Role, Message, CreatedAt, Intent, SessionID, Metadata) 
-                VALUES (?, ?, ?, GETDATE(), ?, ?, ?)
-            """, (user_id, 2, bot_response, intent, session_id, metadata_json))
+                # The bot response is the later row
+                conversation_id = max(row[0] for row in rows)
             
-            cursor.execute("SELECT SCOPE_IDENTITY()")
-            result = cursor.fetchone()
-            conversation_id = result[0] if result else None
-            
-            conn.commit()
-            conn.close()
+                conn.commit()
             
             return conversation_id
             
         except Exception as e:
-            logger.error(f"Save conversation error: {e}")
+            logger.exception("Save conversation error: %s", e)
             # If metadata columns don't exist, fall back to basic save
             try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                
-                # Save without metadata columns
-                cursor.execute("""
-                    INSERT INTO Conversations (UserID, Role, Message, CreatedAt) 
-                    VALUES (?, ?, ?, GETDATE())
-                """, (user_id, 1, user_message))
+                with pool.connection() as conn:
+                    # Save without metadata columns
+                    rows = prepared(conn, SAVE_CONVERSATION_BASIC_SQL).fetchall(user_id, user_message, user_id, bot_response)
                 
-                cursor.execute("""
-                    INSERT INTO Conversations (UserID, Role, Message, CreatedAt) 
-                    VALUES (?, ?, ?, GETDATE())
-                """, (user_id, 2, bot_response))
+                    conversation_id = max(row[0] for row in rows)
                 
-                cursor.execute("SELECT SCOPE_IDENTITY()")
-                result = cursor.fetchone()
-                conversation_id = result[0] if result else None
-                
-                conn.commit()
-                conn.close()
+                    conn.commit()
                 
                 return conversation_id
             except Exception as e2:
-                logger.error(f"Fallback save error: {e2}")
+                logger.exception("Fallback save error: %s", e2)
                 return None 
 
-    def reset_conversation(self, user_id: int) -> Dict[str, Any]:
+    async def reset_conversation(self, user_id: int) -> Dict[str, Any]:
         """
         Reset conversation state and context for a user
         
@@ -1094,18 +1173,18 @@ Keep it concise but informative."""
         """
         try:
             # Clear conversation context from memory
-            if user_id in self.user_contexts:
-                del self.user_contexts[user_id]
+            self.user_contexts.pop(user_id)
+            if redis_client is not None:
+                await asyncio.to_thread(forget_chat_context, user_id)
             
-            logger.info(f"Reset conversation context for user {user_id}")
+            logger.info("Reset conversation context for user %s", user_id)
             
             # Save reset action to database
             reset_message = "Conversation reset requested"
             reset_response = "Sure! Let's start fresh. What kind of product are you looking for?"
             
             # Generate new session ID
-            import uuid
-            new_session_id = str(uuid.uuid4())[:8]
+            new_session_id = uuid.uuid4().hex[:8]
             
             metadata = {
                 'action': 'conversation_reset',
@@ -1113,7 +1192,8 @@ Keep it concise but informative."""
                 'reset_timestamp': datetime.now().isoformat()
             }
             
-            conversation_id = self._save_conversation(
+            conversation_id = await self._run_db(
+                self._save_conversation,
                 user_id=user_id,
                 user_message=reset_message,
                 bot_response=reset_response,
@@ -1131,7 +1211,7 @@ Keep it concise but informative."""
             }
             
         except Exception as e:
-            logger.error(f"Error resetting conversation for user {user_id}: {str(e)}")
+            logger.exception("Error resetting conversation for user %s: %s", user_id, e)
             return {
                 "response": "I apologize, but I couldn't reset the conversation properly. Let's try starting fresh - what can I help you find today?",
                 "products": [],
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+from typing import Optional, Tuple
+
+try:
+    import numpy as np
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+class IntentClassifier:
+    """
+    Local intent classifier: a fine-tuned DistilBERT-style model exported to ONNX.
+
+    The model directory holds model.onnx, the matching tokenizer.json and labels.json,
+    the intent names in the order of the model's output logits.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 32):
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding(length=max_length)
+        with open(os.path.join(model_dir, "labels.json"), encoding="utf-8") as f:
+            self.labels = json.load(f)
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def classify(self, text: str) -> Tuple[str, float]:
+        """Return the most likely intent and its softmax probability"""
+        encoding = self.tokenizer.encode(text)
+        feeds = {
+            "input_ids": np.array([encoding.ids], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask], dtype=np.int64)
+        }
+        # DistilBERT exports take no token_type_ids; pass only what the graph declares
+        feeds = {name: value for name, value in feeds.items() if name in self._input_names}
+        logits = self.session.run(None, feeds)[0][0]
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+def load_intent_classifier(model_dir: Optional[str]) -> Optional[IntentClassifier]:
+    """Load the local intent model if one is configured and onnxruntime is installed"""
+    if not model_dir:
+        return None
+    if onnxruntime is None:
+        logger.warning("INTENT_MODEL_DIR is set but onnxruntime is not installed; using OpenAI for intents")
+        return None
+    try:
+        return IntentClassifier(model_dir)
+    except Exception as e:
+        logger.error("Failed to load intent model from %s: %s", model_dir, e)
+        return None
@@ -0,0 +1,38 @@
+from contextlib import closing
+from itertools import chain
+from typing import Any, Callable, Iterator, Sequence
+
+from fastapi.responses import StreamingResponse
+from app.config import STREAM_BATCH_SIZE
+from app.database import pool
+
+try:
+    import orjson
+    json_bytes = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    json_loads = json.loads
+
+    def json_bytes(obj: Any) -> bytes:
+        """Serialize obj to JSON bytes"""
+        return json.dumps(obj).encode()
+
+def _json_array(sql: str, params: Sequence[Any], to_item: Callable[[Any], dict]) -> Iterator[bytes]:
+    # Owns its connection: dependency cleanup runs before a streamed body is sent
+    with pool.connection() as conn, closing(conn.cursor()) as cursor:
+        cursor.arraysize = STREAM_BATCH_SIZE
+        cursor.execute(sql, *params)
+        yield b"["
+        separator = b""
+        for batch in iter(cursor.fetchmany, []):
+            yield separator + b",".join(json_bytes(to_item(row)) for row in batch)
+            separator = b","
+        yield b"]"
+
+def stream_json_rows(sql: str, params: Sequence[Any], to_item: Callable[[Any], dict]) -> StreamingResponse:
+    """Stream a query's rows as a JSON array, fetching and encoding them batch by batch"""
+    body = _json_array(sql, params, to_item)
+    # Acquire and execute before the status line goes out, so pool and SQL errors still become a 500
+    first = next(body)
+    return StreamingResponse(chain((first,), body), media_type="application/json")
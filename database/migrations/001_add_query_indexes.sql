@@ -0,0 +1,49 @@
+-- Indexes backing the API's hot queries. Every statement is guarded so the
+-- script can be re-run safely.
+USE [ShopDB]
+GO
+
+-- Chat history and GET /conversations: WHERE UserID = ? ORDER BY CreatedAt.
+-- The ordered seek removes the sort. Message is nvarchar(max) and is left out of
+-- INCLUDE so conversation text isn't stored twice; the history endpoints read
+-- only a few rows per call, so their key lookups stay cheap.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Conversations_UserID_CreatedAt' AND object_id = OBJECT_ID('dbo.Conversations'))
+    CREATE INDEX IX_Conversations_UserID_CreatedAt ON dbo.Conversations (UserID, CreatedAt) INCLUDE (Role);
+GO
+
+-- GET /orders: WHERE UserID = ? ORDER BY OrderDate DESC, fully covered.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Orders_UserID_OrderDate' AND object_id = OBJECT_ID('dbo.Orders'))
+    CREATE INDEX IX_Orders_UserID_OrderDate ON dbo.Orders (UserID, OrderDate DESC) INCLUDE (Status, TotalAmount);
+GO
+
+-- GET /orders/{id} items, and the stock updates in payments, filter on OrderID.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OrderItems_OrderID' AND object_id = OBJECT_ID('dbo.OrderItems'))
+    CREATE INDEX IX_OrderItems_OrderID ON dbo.OrderItems (OrderID) INCLUDE (ProductID, Quantity, Price);
+GO
+
+-- One payment per order. The LEFT JOINs from orders, and create_payment's
+-- duplicate check, seek on OrderID. The index is filtered because OrderID is
+-- nullable and a unique index allows only one NULL. Creation fails if an order
+-- already has duplicate payments; remove the duplicates first.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Payments_OrderID' AND object_id = OBJECT_ID('dbo.Payments'))
+    CREATE UNIQUE INDEX IX_Payments_OrderID ON dbo.Payments (OrderID)
+        INCLUDE (PaymentMethod, PaymentStatus, TransactionCode, PaidAt)
+        WHERE OrderID IS NOT NULL;
+GO
+
+-- Cart lookups by owner (get_or_create_cart_id, create_order, chatbot cart actions).
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Cart_UserID' AND object_id = OBJECT_ID('dbo.Cart'))
+    CREATE INDEX IX_Cart_UserID ON dbo.Cart (UserID, CartID);
+GO
+
+-- Cart contents, and the MERGE on (CartID, ProductID) when adding items.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_CartItems_CartID_ProductID' AND object_id = OBJECT_ID('dbo.CartItems'))
+    CREATE INDEX IX_CartItems_CartID_ProductID ON dbo.CartItems (CartID, ProductID) INCLUDE (Quantity);
+GO
+
+-- Product image galleries (GET /products/{id}, and the image half of GET /products).
+-- ImageID is the clustered key, so every nonclustered index already carries it and
+-- this index covers SELECT ImageID, ImageURL ... WHERE ProductID = ? with one range seek.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_ProductImages_ProductID' AND object_id = OBJECT_ID('dbo.ProductImages'))
+    CREATE INDEX IX_ProductImages_ProductID ON dbo.ProductImages (ProductID) INCLUDE (ImageURL);
+GO
@@ -0,0 +1,40 @@
+-- Stored procedures for the order read endpoints. Each one is called as a single
+-- RPC, so the server neither re-parses the batch nor prepares it per connection.
+USE [ShopDB]
+GO
+
+-- GET /orders/{id}: the order header, then its items. Items come back only when
+-- the caller owns the order. Product names are resolved by the API's cache.
+CREATE OR ALTER PROCEDURE dbo.sp_GetOrderDetails
+    @OrderID INT,
+    @UserID INT
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    SELECT OrderID, OrderDate, Status, TotalAmount
+    FROM dbo.Orders
+    WHERE OrderID = @OrderID AND UserID = @UserID;
+
+    SELECT oi.ProductID, oi.Quantity, oi.Price, (oi.Quantity * oi.Price) AS Total
+    FROM dbo.OrderItems oi
+    JOIN dbo.Orders o ON oi.OrderID = o.OrderID
+    WHERE oi.OrderID = @OrderID AND o.UserID = @UserID;
+END
+GO
+
+-- GET /orders/{id}/payment: the order owner and its payment, if any.
+CREATE OR ALTER PROCEDURE dbo.sp_GetOrderAndPayment
+    @OrderID INT
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    SELECT o.UserID,
+           p.PaymentID, p.OrderID, p.PaymentMethod, p.PaymentStatus,
+           p.TransactionCode, p.PaidAt
+    FROM dbo.Orders o
+    LEFT JOIN dbo.Payments p ON p.OrderID = o.OrderID
+    WHERE o.OrderID = @OrderID;
+END
+GO
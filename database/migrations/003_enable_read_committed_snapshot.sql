@@ -0,0 +1,9 @@
+-- Readers see the last committed row version instead of waiting on writers' locks,
+-- so catalog reads don't block behind admin product writes (and vice versa).
+-- Needs a moment with no other connections; ROLLBACK IMMEDIATE ends open transactions.
+USE [master]
+GO
+
+IF EXISTS (SELECT 1 FROM sys.databases WHERE name = 'ShopDB' AND is_read_committed_snapshot_on = 0)
+    ALTER DATABASE [ShopDB] SET READ_COMMITTED_SNAPSHOT ON WITH ROLLBACK IMMEDIATE;
+GO
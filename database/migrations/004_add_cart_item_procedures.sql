@@ -0,0 +1,37 @@
+-- Set-based cart item removal for the chatbot. The product IDs arrive as one
+-- table-valued parameter, so any number of items is removed in a single RPC.
+USE [ShopDB]
+GO
+
+-- A list of distinct integer IDs, passed from pyodbc as a list of 1-tuples.
+IF TYPE_ID('dbo.IntIdList') IS NULL
+    CREATE TYPE dbo.IntIdList AS TABLE (ID INT PRIMARY KEY);
+GO
+
+-- Chatbot remove-from-cart: deletes the listed products from the user's cart and
+-- returns whether the cart exists, how many products were removed and how many
+-- items remain.
+CREATE OR ALTER PROCEDURE dbo.sp_RemoveCartItems
+    @UserID INT,
+    @ProductIDs dbo.IntIdList READONLY
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    DECLARE @CartID INT, @Removed INT;
+
+    -- The same cart get_or_create_cart_id and checkout use
+    SELECT TOP (1) @CartID = CartID FROM dbo.Cart WHERE UserID = @UserID ORDER BY CartID;
+
+    DELETE ci
+    FROM dbo.CartItems ci
+    JOIN @ProductIDs i ON i.ID = ci.ProductID
+    WHERE ci.CartID = @CartID;
+
+    SET @Removed = @@ROWCOUNT;
+
+    SELECT CASE WHEN @CartID IS NULL THEN 0 ELSE 1 END,
+           @Removed,
+           (SELECT COUNT(*) FROM dbo.CartItems WHERE CartID = @CartID);
+END
+GO
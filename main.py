@@ -4,9 +4,7 @@ Web Selling Chatbot API
 Main entry point for the application
 """
 
-from app.main import app
+from app.main import app, run
 
 if __name__ == "__main__":
-    import uvicorn
-    from app.config import API_HOST, API_PORT
-    uvicorn.run(app, host=API_HOST, port=API_PORT)
+    run()